@@ -1,7 +1,17 @@
 
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 import os
+import struct
+
+
+RECORD_SIZE = 64 * 1024
+RECORD_HEADER = struct.Struct("!I")
+GCM_TAG_SIZE = 16
+
+CLIENT_TO_SERVER = 0
+SERVER_TO_CLIENT = 1
 
 class AESEncryptor:
 
@@ -43,4 +53,101 @@ class AESEncryptor:
         return decryptor.finalize()
     
     def get_cipher(self) -> Cipher:
-        return self.cipher
\ No newline at end of file
+        return self.cipher
+
+
+class AESStreamEncryptor:
+
+    def __init__(self, key : bytes=None, iv : bytes=None, server_side : bool=True):
+        self.key = key if key else os.urandom(32)
+        self.iv = iv if iv else os.urandom(16)
+        send_direction, recv_direction = (SERVER_TO_CLIENT, CLIENT_TO_SERVER) if server_side else (CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+        # one keystream per direction, continued across calls instead of restarted
+        self.encryptor = Cipher(algorithms.AES(self.key), modes.CTR(self._nonce(send_direction)), backend=default_backend()).encryptor()
+        self.decryptor = Cipher(algorithms.AES(self.key), modes.CTR(self._nonce(recv_direction)), backend=default_backend()).decryptor()
+
+    def _nonce(self, direction : int) -> bytes:
+        # the lower 64 bits are the block counter
+        return bytes([direction]) + self.iv[1:8] + bytes(8)
+
+    def get_key(self) -> bytes:
+        return self.key
+
+    def get_iv(self) -> bytes:
+        return self.iv
+
+    def encrypt(self, content : bytes) -> bytes:
+        return self.encryptor.update(content)
+
+    def decrypt(self, content : bytes) -> bytes:
+        return self.decryptor.update(content)
+
+
+class AESRecordEncryptor:
+
+    def __init__(self, key : bytes=None, iv : bytes=None, server_side : bool=True, record_size : int=RECORD_SIZE):
+        self.key = key if key else os.urandom(32)
+        self.iv = iv if iv else os.urandom(16)
+        self.record_size = record_size
+        self.aead = AESGCM(self.key)
+        self.send_direction, self.recv_direction = (SERVER_TO_CLIENT, CLIENT_TO_SERVER) if server_side else (CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+        self.send_sequence = 0
+        self.recv_sequence = 0
+        self.pending = bytearray()
+
+    def _nonce(self, direction : int, sequence : int) -> bytes:
+        # nonces are never sent, both peers count the records of each direction
+        return bytes([direction]) + self.iv[1:4] + sequence.to_bytes(8, "big")
+
+    def get_key(self) -> bytes:
+        return self.key
+
+    def get_iv(self) -> bytes:
+        return self.iv
+
+    def encrypt(self, content : bytes) -> bytes:
+        records = []
+        view = memoryview(content)
+        for offset in range(0, len(view), self.record_size):
+            plain = view[offset:offset + self.record_size]
+            header = RECORD_HEADER.pack(len(plain) + GCM_TAG_SIZE)
+            nonce = self._nonce(self.send_direction, self.send_sequence)
+            self.send_sequence += 1
+            records.append(header)
+            records.append(self.aead.encrypt(nonce, plain, header))
+        return b"".join(records)
+
+    def decrypt(self, content : bytes) -> bytes:
+        # returns the plaintext of all complete records, a partial record waits for more data
+        self.pending += content
+        plains = []
+        offset = 0
+        while len(self.pending) - offset >= RECORD_HEADER.size:
+            length, = RECORD_HEADER.unpack_from(self.pending, offset)
+            if length < GCM_TAG_SIZE or length > self.record_size + GCM_TAG_SIZE:
+                raise ValueError("Invalid encrypted record length")
+            end = offset + RECORD_HEADER.size + length
+            if end > len(self.pending):
+                break
+            header = bytes(self.pending[offset:offset + RECORD_HEADER.size])
+            nonce = self._nonce(self.recv_direction, self.recv_sequence)
+            self.recv_sequence += 1
+            plains.append(self.aead.decrypt(nonce, bytes(self.pending[offset + RECORD_HEADER.size:end]), header))
+            offset = end
+        del self.pending[:offset]
+        return b"".join(plains)
+
+    def has_pending(self) -> bool:
+        return len(self.pending) > 0
+
+
+ENCRYPT_MODES = {
+    "cfb": AESEncryptor,
+    "ctr": AESStreamEncryptor,
+    "gcm": AESRecordEncryptor,
+}
+
+def create_encryptor(mode : str, key : bytes=None, iv : bytes=None, server_side : bool=True):
+    if mode == "cfb":
+        return AESEncryptor(key, iv)
+    return ENCRYPT_MODES[mode](key, iv, server_side=server_side)
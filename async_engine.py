@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from http_connection import HTTPConnection, RECV_SIZE
+from connection_manager import LINGER_READ_SIZE
+from log import LogLevel
+
+
+class AsyncEngine:
+
+    def __init__(self, server, max_workers : int=None):
+        self.server = server
+        self.max_workers = max_workers
+        self.executor = None
+        self.loop = None
+        self.tasks = set()
+
+    def run(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="http-worker")
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(self.executor)
+        accepts = [self._accept(self.server.socket, None)]
+        if self.server.tls_socket:
+            accepts.append(self._accept(self.server.tls_socket, self.server.tls_context))
+        await asyncio.gather(*accepts)
+
+    async def _accept(self, listener : socket.socket, tls_context : ssl.SSLContext):
+        listener.setblocking(False)
+        while True:
+            conn, addr = await self.loop.sock_accept(listener)
+            task = self.loop.create_task(self._handle_connection(conn, addr, tls_context))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _wait_readable(self, sock : socket.socket, timeout : float) -> bool:
+        future = self.loop.create_future()
+        fd = sock.fileno()
+        self.loop.add_reader(fd, self._on_readable, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.loop.remove_reader(fd)
+
+    @staticmethod
+    def _on_readable(future : asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    async def _handle_connection(self, sock : socket.socket, addr : tuple, tls_context : ssl.SSLContext=None):
+        self.server.log.log(
+            LogLevel.INFO, f"Receive new connection from {addr[0]}:{addr[1]}")
+        if tls_context:
+            sock = tls_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+            if not await self.loop.run_in_executor(self.executor, self.server.do_handshake, sock, addr):
+                self.server.close_connection(sock, addr)
+                return
+        conn = HTTPConnection(sock)
+        self.server.connections.register(conn, addr)
+        while True:
+            # a pipelined request may already be buffered
+            if not conn.has_buffered_data():
+                sock.setblocking(False)
+                self.server.connections.set_idle(conn)
+                readable = await self._wait_readable(sock, self.server.idle_timeout)
+                self.server.connections.set_active(conn)
+                if not readable:
+                    self.server.log.log(
+                        LogLevel.INFO, f"Timeout from {addr[0]}:{addr[1]}")
+                    break
+            if not await self._read_header(conn):
+                # peer closed the connection while idle
+                break
+            keep_alive = await self.loop.run_in_executor(
+                self.executor, self.server.serve_request, conn, addr)
+            if not keep_alive:
+                break
+        await self._linger(conn)
+        self.server.close_connection(conn, addr)
+
+    async def _recv(self, sock : socket.socket, timeout : float) -> bytes:
+        if not isinstance(sock, ssl.SSLSocket):
+            return await asyncio.wait_for(self.loop.sock_recv(sock, RECV_SIZE), timeout)
+        # the loop cannot read ssl sockets, a record may take more than one readable event to arrive
+        deadline = self.loop.time() + timeout
+        while True:
+            try:
+                return sock.recv(RECV_SIZE)
+            except (ssl.SSLWantReadError, BlockingIOError):
+                remaining = deadline - self.loop.time()
+                if remaining <= 0 or not await self._wait_readable(sock, remaining):
+                    raise asyncio.TimeoutError()
+
+    async def _read_header(self, conn : HTTPConnection) -> bool:
+        # a slow client only holds the loop until its header block is complete, the executor then
+        # parses it from the buffer; on timeout, overflow or a close handle_request answers as usual
+        server = self.server
+        conn.conn.setblocking(False)
+        conn.header_deadline = None
+        deadline = self.loop.time() + server.header_timeout
+        while not self._header_complete(conn):
+            if len(conn.buffer) > server.max_header_size:
+                return True
+            remaining = deadline - self.loop.time()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                data = await self._recv(conn.conn, remaining)
+            except asyncio.TimeoutError:
+                # already expired, read_until gives up without waiting in the worker thread
+                conn.header_deadline = time.monotonic()
+                return True
+            except OSError:
+                return conn.has_buffered_data()
+            if not data:
+                return conn.has_buffered_data()
+            metrics.HTTP_RECEIVED_BYTES.inc(len(data))
+            conn.feed(data)
+        return True
+
+    @staticmethod
+    def _header_complete(conn : HTTPConnection) -> bool:
+        buffer = conn.buffer
+        start = 0
+        # empty lines ahead of a request are skipped like read_until does
+        while buffer.startswith(b"\r\n", start):
+            start += 2
+        return buffer.find(b"\r\n\r\n", start) != -1
+
+    async def _linger(self, conn : HTTPConnection):
+        # half close and drain on the event loop, close_connection then finds the peer gone
+        manager = self.server.connections
+        try:
+            conn.shutdown(socket.SHUT_WR)
+            conn.conn.setblocking(False)
+            deadline = self.loop.time() + manager.linger_timeout
+            drained = 0
+            while drained < manager.linger_size:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0 or not await self._wait_readable(conn.conn, remaining):
+                    break
+                try:
+                    data = conn.conn.recv(LINGER_READ_SIZE)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    break
+                drained += len(data)
+        except OSError:
+            pass
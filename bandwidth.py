@@ -0,0 +1,81 @@
+import threading
+import time
+from metrics import REGISTRY
+
+
+MIN_QUANTUM = 4 * 1024
+MAX_QUANTUM = 256 * 1024
+
+THROTTLE_SECONDS = REGISTRY.counter("bandwidth_throttle_seconds_total", "Time transfers waited for bandwidth tokens", ("direction",))
+
+class TokenBucket:
+
+    def __init__(self, rate : float, burst : float=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate / 10, MIN_QUANTUM)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount : int) -> float:
+        # tokens may go negative, every caller waits until its own reservation is covered,
+        # so concurrent transfers are served in the order they asked and share the rate evenly
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Throttle:
+
+    def __init__(self, connection_bucket : TokenBucket, global_bucket : TokenBucket):
+        self.connection_bucket = connection_bucket
+        self.global_bucket = global_bucket
+        self.user_bucket = None
+
+    def buckets(self) -> list:
+        return [bucket for bucket in (self.connection_bucket, self.user_bucket, self.global_bucket) if bucket]
+
+    def quantum(self) -> int:
+        # about 50ms worth of the tightest limit, small enough to interleave with other transfers
+        buckets = self.buckets()
+        if not buckets:
+            return MAX_QUANTUM
+        return int(min(MAX_QUANTUM, max(MIN_QUANTUM, min(bucket.rate for bucket in buckets) / 20)))
+
+    def wait(self, amount : int, direction : str="send"):
+        delay = 0.0
+        for bucket in self.buckets():
+            delay = max(delay, bucket.reserve(amount))
+        if delay > 0:
+            THROTTLE_SECONDS.labels(direction).inc(delay)
+            time.sleep(delay)
+
+
+class BandwidthLimiter:
+
+    def __init__(self, connection_rate : int=0, user_rate : int=0, global_rate : int=0):
+        self.connection_rate = connection_rate
+        self.user_rate = user_rate
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.user_buckets = dict()
+        self.lock = threading.Lock()
+        self.enabled = bool(connection_rate or user_rate or global_rate)
+
+    def bind(self, conn, user : str):
+        if not self.enabled:
+            return
+        if conn.throttle is None:
+            # the connection bucket lives as long as the connection, across keep-alive requests
+            conn.throttle = Throttle(TokenBucket(self.connection_rate) if self.connection_rate else None, self.global_bucket)
+        # user names are case insensitive, every spelling shares one bucket
+        conn.throttle.user_bucket = self.user_bucket(user.lower()) if self.user_rate and user else None
+
+    def user_bucket(self, user : str) -> TokenBucket:
+        bucket = self.user_buckets.get(user)
+        if bucket is None:
+            with self.lock:
+                bucket = self.user_buckets.setdefault(user, TokenBucket(self.user_rate))
+        return bucket
@@ -0,0 +1,66 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aes_encryptor import create_encryptor
+from http_connection import HTTPConnection
+
+
+def cipher_only(mode : str, data : bytes, chunk_size : int) -> float:
+    server = create_encryptor(mode)
+    client = create_encryptor(mode, server.get_key(), server.get_iv(), server_side=False)
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk_size):
+        client.decrypt(server.encrypt(data[offset:offset + chunk_size]))
+    return time.perf_counter() - start
+
+def connection(mode : str, data : bytes, chunk_size : int) -> float:
+    # the server side HTTPConnection sends, the client side one receives through a socket pair
+    server_sock, client_sock = socket.socketpair()
+    server = create_encryptor(mode)
+    client = create_encryptor(mode, server.get_key(), server.get_iv(), server_side=False)
+    sender = HTTPConnection(server_sock, server)
+    receiver = HTTPConnection(client_sock, client)
+
+    def send():
+        for offset in range(0, len(data), chunk_size):
+            sender.sendall(data[offset:offset + chunk_size])
+        server_sock.shutdown(socket.SHUT_WR)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=send)
+    thread.start()
+    received = 0
+    while True:
+        piece = receiver.recv(1024 * 1024)
+        if not piece:
+            break
+        received += len(piece)
+    thread.join()
+    elapsed = time.perf_counter() - start
+    server_sock.close()
+    client_sock.close()
+    if received != len(data):
+        raise RuntimeError(f"{mode}: received {received} of {len(data)} bytes")
+    return elapsed
+
+def report(name : str, mode : str, size_mb : int, elapsed : float):
+    print(f"{name:>10} {mode:>4}: {size_mb} MB in {elapsed:.2f}s, {size_mb / elapsed:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the throughput of the ENCRYPT transport modes")
+    parser.add_argument("--size-mb", type=int, default=256, help="Amount of data to transfer in MB")
+    parser.add_argument("--chunk-kb", type=int, default=64, help="Size of each sendall call in KB")
+    parser.add_argument("--modes", type=str, default="cfb,ctr,gcm", help="Comma separated modes to run")
+    args = parser.parse_args()
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    for mode in args.modes.split(","):
+        report("cipher", mode, args.size_mb, cipher_only(mode, data, args.chunk_kb * 1024))
+        # legacy cfb restarts its keystream per call, the receiver output is not the plaintext
+        report("connection", mode, args.size_mb, connection(mode, data, args.chunk_kb * 1024))
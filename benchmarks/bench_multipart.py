@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multipart import MultipartParser
+
+
+BOUNDARY = b"----CS305BenchBoundary7MA4YWxkTrZu0gW"
+
+def generate_body(size : int, chunk_size : int, no_newlines : bool):
+    block = os.urandom(1024 * 1024)
+    if no_newlines:
+        block = block.replace(b"\n", b"\x00")
+    head = b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench.bin\"\r\nContent-Type: application/octet-stream\r\n\r\n"
+    tail = b"\r\n--" + BOUNDARY + b"--\r\n"
+    pending = bytearray(head)
+    rest = size
+    while rest > 0 or pending:
+        while len(pending) < chunk_size and rest > 0:
+            n = min(rest, len(block))
+            pending += block[:n]
+            rest -= n
+            if rest == 0:
+                pending += tail
+        yield bytes(pending[:chunk_size])
+        del pending[:chunk_size]
+
+def legacy_parse(chunks, boundary : bytes, out_dir : str):
+    # the tempfile + readline path that handle_request_post used before the streaming parser
+    with tempfile.TemporaryFile(mode="w+b") as tmp:
+        for body in chunks:
+            tmp.write(body)
+        tmp.flush()
+        tmp.seek(0)
+        current_file = None
+        next_line = tmp.readline()
+        while True:
+            line = next_line
+            if not line:
+                raise ValueError("Bad Request")
+            if line.startswith(b"--" + boundary + b"--"):
+                if current_file:
+                    current_file.close()
+                break
+            if line.startswith(boundary) or line.startswith(b"--" + boundary):
+                if current_file:
+                    current_file.close()
+                while True:
+                    line = tmp.readline()
+                    if line == b"\r\n":
+                        break
+                current_file = open(os.path.join(out_dir, "legacy.bin"), "wb")
+                next_line = tmp.readline()
+                continue
+            next_line = tmp.readline()
+            if next_line and (next_line.startswith(boundary) or next_line.startswith(b"--" + boundary)):
+                line = line[:-len(b"\r\n")]
+            current_file.write(line)
+
+def streaming_parse(chunks, boundary : bytes, out_dir : str):
+    parser = MultipartParser(boundary, lambda headers: open(os.path.join(out_dir, "streaming.bin"), "wb"))
+    for body in chunks:
+        parser.feed(body)
+    parser.close()
+    if not parser.is_done():
+        raise ValueError("Bad Request")
+
+def run(name : str, parse, args, out_dir : str) -> float:
+    size = args.size_mb * 1024 * 1024
+    start = time.perf_counter()
+    parse(generate_body(size, args.chunk_kb * 1024, args.no_newlines), BOUNDARY, out_dir)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {args.size_mb} MB in {elapsed:.2f}s, {args.size_mb / elapsed:.1f} MB/s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the legacy and streaming multipart upload parsers")
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of the uploaded file in MB")
+    parser.add_argument("--chunk-kb", type=int, default=256, help="Size of each received chunk in KB")
+    parser.add_argument("--no-newlines", action="store_true", help="Strip newline bytes from the payload, legacy readline then reads it as one huge line")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only run the streaming parser")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as out_dir:
+        streaming = run("streaming", streaming_parse, args, out_dir)
+        if not args.skip_legacy:
+            legacy = run("legacy", legacy_parse, args, out_dir)
+            print(f"speedup: {legacy / streaming:.2f}x")
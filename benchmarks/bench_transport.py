@@ -0,0 +1,145 @@
+import argparse
+import base64
+import datetime
+import http.client
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from aes_encryptor import create_encryptor
+from http_connection import HTTPConnection
+from rsa_encryptor import RSAEncryptor
+
+
+AUTHORIZATION = "Basic " + base64.b64encode(b"client1:123").decode()
+
+def generate_certificate(cert_path : str, key_path : str):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+
+def wait_for_port(port : int, timeout : float=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not listen on port {port}")
+
+def download_http(connection : http.client.HTTPConnection, path : str) -> int:
+    connection.request("GET", path, headers={"Authorization": AUTHORIZATION, "Connection": "keep-alive", "Accept-Encoding": "identity"})
+    response = connection.getresponse()
+    size = 0
+    while True:
+        data = response.read(1024 * 1024)
+        if not data:
+            break
+        size += len(data)
+    return size
+
+def read_head(conn : HTTPConnection) -> dict:
+    conn.set_body_length(None)
+    head = conn.read_until(b"\r\n\r\n", 64 * 1024)
+    return dict(line.split(": ", 1) for line in head.decode().split("\r\n")[1:])
+
+def open_encrypted(port : int, mode : str) -> HTTPConnection:
+    rsa_encryptor = RSAEncryptor()
+    public_key = rsa_encryptor.get_public_key()
+    conn = HTTPConnection(socket.create_connection(("127.0.0.1", port)))
+    conn.sendall(f"ENCRYPT / HTTP/1.1\r\nConnection: keep-alive\r\nEncrypt-Mode: {mode}\r\nContent-Length: {len(public_key)}\r\n\r\n".encode() + public_key)
+    length = int(read_head(conn)["Content-Length"])
+    conn.set_body_length(length)
+    body = b""
+    while len(body) < length:
+        body += conn.recv(length - len(body))
+    secret = rsa_encryptor.decode_content(body)
+    conn.set_encryptor(create_encryptor(mode, secret[:32], secret[32:], server_side=False))
+    return conn
+
+def download_encrypted(conn : HTTPConnection, path : str) -> int:
+    conn.sendall(f"GET {path} HTTP/1.1\r\nConnection: keep-alive\r\nAuthorization: {AUTHORIZATION}\r\n\r\n".encode())
+    length = int(read_head(conn)["Content-Length"])
+    conn.set_body_length(length)
+    size = 0
+    while size < length:
+        data = conn.recv(1024 * 1024)
+        if not data:
+            break
+        size += len(data)
+    return size
+
+def measure(name : str, download, repeat : int, size_mb : int):
+    download()
+    start = time.perf_counter()
+    total = 0
+    for _ in range(repeat):
+        total += download()
+    elapsed = time.perf_counter() - start
+    if total != repeat * size_mb * 1024 * 1024:
+        raise RuntimeError(f"{name}: received {total} bytes")
+    print(f"{name:>12}: {repeat} x {size_mb} MB in {elapsed:.2f}s, {repeat * size_mb / elapsed:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare download throughput over plaintext, TLS and the ENCRYPT modes")
+    parser.add_argument("--size-mb", type=int, default=64, help="Size of the downloaded file in MB")
+    parser.add_argument("--repeat", type=int, default=5, help="Downloads per transport")
+    parser.add_argument("--port", type=int, default=18080, help="Plaintext port of the benchmarked server")
+    parser.add_argument("--tls-port", type=int, default=18443, help="TLS port of the benchmarked server")
+    parser.add_argument("--engine", type=str, default="thread", choices=["thread", "pool", "async"], help="Server engine")
+    # the legacy cfb mode restarts its keystream per call and cannot be decoded by a streaming client
+    parser.add_argument("--encrypt-modes", type=str, default="ctr,gcm", help="Comma separated ENCRYPT modes to run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        for template in ("index.html", "view_files.html"):
+            shutil.copy(os.path.join(ROOT, template), cwd)
+        os.makedirs(os.path.join(cwd, "data", "client1"))
+        with open(os.path.join(cwd, "data", "client1", "bench.bin"), "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        cert_path = os.path.join(cwd, "cert.pem")
+        key_path = os.path.join(cwd, "key.pem")
+        generate_certificate(cert_path, key_path)
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "-i", "127.0.0.1", "-p", str(args.port),
+                                   "--engine", args.engine, "--log-level", "WARNING",
+                                   "--tls-port", str(args.tls_port), "--cert", cert_path, "--key", key_path],
+                                  cwd=cwd, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            wait_for_port(args.tls_port)
+            path = "/client1/bench.bin"
+            plain = http.client.HTTPConnection("127.0.0.1", args.port)
+            measure("plaintext", lambda: download_http(plain, path), args.repeat, args.size_mb)
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            tls = http.client.HTTPSConnection("127.0.0.1", args.tls_port, context=context)
+            measure("tls", lambda: download_http(tls, path), args.repeat, args.size_mb)
+            for mode in args.encrypt_modes.split(","):
+                encrypted = open_encrypted(args.port, mode)
+                measure(f"encrypt-{mode}", lambda: download_encrypted(encrypted, path), args.repeat, args.size_mb)
+        finally:
+            server.terminate()
+            server.wait()
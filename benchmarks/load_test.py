@@ -0,0 +1,343 @@
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aes_encryptor import create_encryptor
+from http_connection import HTTPConnection
+from rsa_encryptor import RSAEncryptor
+
+
+USER = "client1"
+PASSWORD = "123"
+AUTHORIZATION = "Basic " + base64.b64encode(f"{USER}:{PASSWORD}".encode()).decode()
+MAX_HEADER_SIZE = 64 * 1024
+READ_SIZE = 256 * 1024
+
+LISTING_SIZES = {"listing_small": 10, "listing_medium": 1000, "listing_large": 10000}
+
+class ClientError(Exception):
+    pass
+
+
+class Client:
+
+    def __init__(self, port : int, encrypt_mode : str=None):
+        self.port = port
+        self.encrypt_mode = encrypt_mode
+        self.conn = None
+        self.cookie = None
+
+    def connect(self):
+        self.close()
+        self.conn = HTTPConnection(socket.create_connection(("127.0.0.1", self.port)))
+        self.conn.settimeout(30)
+        if self.encrypt_mode:
+            self._handshake()
+
+    def close(self):
+        if self.conn:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+            self.conn = None
+
+    def _handshake(self):
+        rsa_encryptor = RSAEncryptor()
+        public_key = rsa_encryptor.get_public_key()
+        status, _, body = self._exchange("ENCRYPT", "/", {"Encrypt-Mode": self.encrypt_mode, "Content-Length": str(len(public_key))}, public_key)
+        if status != 200:
+            raise ClientError(f"ENCRYPT failed with {status}")
+        secret = rsa_encryptor.decode_content(body)
+        self.conn.set_encryptor(create_encryptor(self.encrypt_mode, secret[:32], secret[32:], server_side=False))
+
+    def request(self, method : str, uri : str, headers : dict=None, body : bytes=b"", auth : bool=True) -> (int, dict, bytes):
+        # reconnects once when the server closed an idle keep-alive connection
+        for attempt in range(2):
+            if self.conn is None:
+                self.connect()
+            request_headers = dict()
+            if auth:
+                if self.cookie:
+                    request_headers["Cookie"] = self.cookie
+                else:
+                    request_headers["Authorization"] = AUTHORIZATION
+            request_headers.update(headers or dict())
+            try:
+                status, response_headers, response_body = self._exchange(method, uri, request_headers, body)
+            except (ClientError, OSError):
+                self.close()
+                if attempt == 1:
+                    raise
+                continue
+            if "Set-Cookie" in response_headers:
+                self.cookie = response_headers["Set-Cookie"].split(";")[0]
+            if response_headers.get("Connection", "").lower() != "keep-alive":
+                self.close()
+            return status, response_headers, response_body
+
+    def _exchange(self, method : str, uri : str, headers : dict, body : bytes) -> (int, dict, bytes):
+        lines = [f"{method} {uri} HTTP/1.1", "Host: 127.0.0.1", "Connection: keep-alive"]
+        if body and "Content-Length" not in headers:
+            headers["Content-Length"] = str(len(body))
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        self.conn.sendall(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        self.conn.set_body_length(None)
+        head = self.conn.read_until(b"\r\n\r\n", MAX_HEADER_SIZE)
+        if head is None:
+            raise ClientError("connection closed")
+        head = head.decode().split("\r\n")
+        status = int(head[0].split(" ")[1])
+        response_headers = dict(line.split(": ", 1) for line in head[1:] if ": " in line)
+        if method == "HEAD" or status == 304:
+            return status, response_headers, b""
+        if response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            return status, response_headers, self._read_chunked()
+        return status, response_headers, self._read_body(int(response_headers.get("Content-Length", 0)))
+
+    def _read_body(self, length : int) -> bytes:
+        self.conn.set_body_length(length)
+        body = bytearray()
+        while len(body) < length:
+            data = self.conn.recv(READ_SIZE)
+            if not data:
+                raise ClientError("body truncated")
+            body += data
+        return bytes(body)
+
+    def _read_chunked(self) -> bytes:
+        body = bytearray()
+        while True:
+            self.conn.set_body_length(None)
+            size_line = self.conn.read_until(b"\r\n", MAX_HEADER_SIZE)
+            if size_line is None:
+                raise ClientError("chunked body truncated")
+            size = int(size_line.split(b";")[0], 16)
+            if size == 0:
+                self.conn.read_until(b"\r\n", MAX_HEADER_SIZE)
+                return bytes(body)
+            body += self._read_body(size)
+            self.conn.set_body_length(None)
+            self.conn.read_until(b"\r\n", MAX_HEADER_SIZE)
+
+
+def seed_data(cwd : str, file_mb : int) -> dict:
+    for template in ("index.html", "view_files.html"):
+        shutil.copy(os.path.join(ROOT, template), cwd)
+    user_dir = os.path.join(cwd, "data", USER)
+    os.makedirs(os.path.join(user_dir, "uploads"))
+    with open(os.path.join(user_dir, "small.txt"), "w") as f:
+        f.write("hello world\n" * 100)
+    with open(os.path.join(user_dir, "large.bin"), "wb") as f:
+        for _ in range(file_mb):
+            f.write(os.urandom(1024 * 1024))
+    for name, count in LISTING_SIZES.items():
+        listing_dir = os.path.join(user_dir, name)
+        os.makedirs(listing_dir)
+        for i in range(count):
+            open(os.path.join(listing_dir, f"file_{i:05}.txt"), "w").close()
+    return {"large_size": file_mb * 1024 * 1024}
+
+def build_scenarios(fixtures : dict, upload_kb : int) -> dict:
+    large_size = fixtures["large_size"]
+    upload_data = os.urandom(upload_kb * 1024)
+
+    def expect(status : int, expected : int=200):
+        if status != expected:
+            raise ClientError(f"unexpected status {status}")
+
+    def login(client : Client):
+        client.cookie = None
+        status, headers, _ = client.request("GET", f"/{USER}/small.txt")
+        expect(status)
+        if "Set-Cookie" not in headers:
+            raise ClientError("no session cookie")
+
+    def cookie_get(client : Client):
+        if client.cookie is None:
+            login(client)
+        status, _, _ = client.request("GET", f"/{USER}/small.txt")
+        expect(status)
+
+    def listing(name : str):
+        def run(client : Client):
+            expect(client.request("GET", f"/{USER}/{name}/")[0])
+        return run
+
+    def listing_json(client : Client):
+        expect(client.request("GET", f"/{USER}/listing_large/?format=json&limit=1000")[0])
+
+    def download_full(client : Client):
+        status, _, body = client.request("GET", f"/{USER}/large.bin")
+        expect(status)
+        if len(body) != large_size:
+            raise ClientError("short download")
+
+    def download_chunked(client : Client):
+        status, _, body = client.request("GET", f"/{USER}/large.bin?chunked=1")
+        expect(status)
+        if len(body) != large_size:
+            raise ClientError("short chunked download")
+
+    def download_range(client : Client):
+        start = random.randrange(0, large_size - 64 * 1024)
+        status, _, body = client.request("GET", f"/{USER}/large.bin", headers={"Range": f"bytes={start}-{start + 64 * 1024 - 1}"})
+        expect(status, 206)
+        if len(body) != 64 * 1024:
+            raise ClientError("short range")
+
+    def upload(client : Client):
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{uuid.uuid4().hex}.bin\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode() + upload_data + f"\r\n--{boundary}--\r\n".encode()
+        status, _, _ = client.request("POST", f"/upload?path=/{USER}/uploads/", headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}, body=body)
+        expect(status)
+
+    scenarios = {
+        "login": (login, None),
+        "cookie_get": (cookie_get, None),
+        "listing_json": (listing_json, None),
+        "download_full": (download_full, None),
+        "download_chunked": (download_chunked, None),
+        "download_range": (download_range, None),
+        "upload": (upload, None),
+        "encrypt_gcm": (cookie_get, "gcm"),
+        "encrypt_ctr": (cookie_get, "ctr"),
+    }
+    for name in LISTING_SIZES:
+        scenarios[name] = (listing(name), None)
+    return scenarios
+
+def percentile(sorted_values : list, fraction : float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_scenario(port : int, run, encrypt_mode : str, concurrency : int, duration : float, warmup : float) -> dict:
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start_event = threading.Event()
+    measure_from = [0.0]
+    stop_at = [0.0]
+
+    def worker(index : int):
+        client = Client(port, encrypt_mode)
+        start_event.wait()
+        while True:
+            begin = time.perf_counter()
+            if begin >= stop_at[0]:
+                break
+            try:
+                run(client)
+                end = time.perf_counter()
+                if begin >= measure_from[0]:
+                    latencies[index].append(end - begin)
+            except (ClientError, OSError, ValueError) as e:
+                errors[index] += 1
+                client.close()
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    now = time.perf_counter()
+    measure_from[0] = now + warmup
+    stop_at[0] = now + warmup + duration
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    values = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    return {
+        "requests": len(values),
+        "errors": sum(errors),
+        "rps": round(len(values) / duration, 1),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+def wait_for_port(port : int, timeout : float=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not listen on port {port}")
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start server.py on a loopback port and load test it with concurrent keep-alive clients")
+    parser.add_argument("--port", type=int, default=18081, help="Loopback port of the tested server")
+    parser.add_argument("--scenarios", type=str, default=None, help="Comma separated scenarios to run, all by default")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections per scenario")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--file-mb", type=int, default=4, help="Size of the downloaded file in MB")
+    parser.add_argument("--upload-kb", type=int, default=256, help="Size of each uploaded file in KB")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("server_args", nargs=argparse.REMAINDER, help="Extra server.py arguments after --, e.g. -- --engine async")
+    args = parser.parse_args()
+    server_args = [arg for arg in args.server_args if arg != "--"]
+
+    with tempfile.TemporaryDirectory() as cwd:
+        fixtures = seed_data(cwd, args.file_mb)
+        scenarios = build_scenarios(fixtures, args.upload_kb)
+        names = args.scenarios.split(",") if args.scenarios else list(scenarios)
+        unknown = [name for name in names if name not in scenarios]
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(unknown)}, choose from {', '.join(scenarios)}")
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "-i", "127.0.0.1", "-p", str(args.port),
+                                   "--log-level", "WARNING", "--max-requests", "1000000"] + server_args,
+                                  cwd=cwd, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            results = dict()
+            for name in names:
+                run, encrypt_mode = scenarios[name]
+                results[name] = run_scenario(args.port, run, encrypt_mode, args.concurrency, args.duration, args.warmup)
+                print(f"{name}: {results[name]}", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "file_mb": args.file_mb,
+            "upload_kb": args.upload_kb,
+            "server_args": server_args,
+        },
+        "scenarios": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
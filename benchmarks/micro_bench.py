@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils
+from dir_cache import DirectoryCache
+from http_request import HTTPRequest
+from http_response import HTTPResponse
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+
+def build_cases(tmp_dir : str) -> dict:
+    encoded_name = urllib.parse.quote("报告 final (copy) #1.txt")
+    long_uri = "/client1/" + "/".join([encoded_name] * 64) + "?SUSTech-HTTP=0&chunked=1"
+    plain_uri = "/client1/documents/projects/report.txt"
+    many_ranges = "bytes=" + ",".join(f"{i * 4096}-{i * 4096 + 1023}" for i in range(200))
+    overlapping_ranges = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 100}" for i in range(200))
+    request_head = "GET " + long_uri + " HTTP/1.1\r\n" + "\r\n".join(f"X-Header-{i}: value {i}; with: colon" for i in range(100))
+    deep_path = "/".join(f"folder_{i}" for i in range(40)) + "/../" * 5 + "file.txt"
+    response = HTTPResponse.build(headers={f"X-Header-{i}": f"value {i}" for i in range(20)}, content_type="text/html; charset=utf-8",
+                                  keep_alive=True, set_cookie="session-id=5f1c7a3e-8d2b-4c61-9a4e-0b7d3f2e1c9a; Max-Age=3600")
+
+    listing_dir = os.path.join(tmp_dir, "listing")
+    os.makedirs(listing_dir)
+    for i in range(10000):
+        open(os.path.join(listing_dir, f"file_{i:05}.txt"), "w").close()
+    entries = DirectoryCache.scan(listing_dir)
+
+    return {
+        "unquote_uri_long": (lambda: utils.unquote_uri(long_uri), 200),
+        "unquote_uri_plain": (lambda: utils.unquote_uri(plain_uri), 20000),
+        "parse_ranges_200": (lambda: utils.parse_ranges(many_ranges, 1 << 30), 500),
+        "parse_ranges_overlapping_200": (lambda: utils.parse_ranges(overlapping_ranges, 1 << 30), 500),
+        "normalize_and_validate_path": (lambda: utils.normalize_and_validate_path("./data", deep_path), 5000),
+        "build_by_headers_100": (lambda: HTTPRequest.build_by_headers(request_head, b""), 1000),
+        "build_response_headers_20": (lambda: response._build_headers(), 10000),
+        "scan_directory_10000": (lambda: DirectoryCache.scan(listing_dir), 5),
+        "render_file_explore_html_10000": (lambda: utils.render_file_explore_html("client1/listing", "client1", entries), 5),
+        "file_explore_html_cached_10000": (lambda: utils.file_explore_html("client1/listing", "client1", listing_dir), 1000),
+    }
+
+def measure(func, number : int, repeat : int) -> dict:
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "min_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+        "peak_kb": round(peak / 1024, 1),
+        "result_kb": round(current / 1024, 1),
+    }
+
+def compare(results : dict, baseline : dict, threshold : float) -> list:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:>32}: {result['min_us']:>12.3f} us (no baseline)")
+            continue
+        ratio = result["min_us"] / baseline[name]["min_us"] if baseline[name]["min_us"] else 1.0
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:>32}: {result['min_us']:>12.3f} us, baseline {baseline[name]['min_us']:>12.3f} us, {ratio:.2f}x{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the per-request pure-Python helpers")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per case, the fastest round is reported")
+    parser.add_argument("--cases", type=str, default=None, help="Comma separated cases to run, all by default")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="Compare with the baseline file, exit with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=1.5, help="Slowdown ratio counted as a regression")
+    parser.add_argument("--baseline", type=str, default=BASELINE_FILE, help="Baseline file")
+    args = parser.parse_args()
+
+    # the listing template is loaded from the working directory
+    os.chdir(ROOT)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = build_cases(tmp_dir)
+        names = args.cases.split(",") if args.cases else list(cases)
+        results = dict()
+        for name in names:
+            func, number = cases[name]
+            results[name] = measure(func, number, args.repeat)
+            if not args.compare:
+                print(f"{name:>32}: {json.dumps(results[name])}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "cases": results}, f, indent=2)
+            f.write("\n")
@@ -0,0 +1,94 @@
+import unittest
+from http_connection import HTTPConnection, ChunkedEncodingError, BodyTooLargeError
+
+
+class FakeSocket:
+
+    def __init__(self, pieces):
+        # every recv returns the next piece, like separate TCP segments
+        self.pieces = list(pieces)
+
+    def setsockopt(self, *args):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        if not self.pieces:
+            return b""
+        piece = self.pieces.pop(0)
+        if len(piece) > size:
+            self.pieces.insert(0, piece[size:])
+            piece = piece[:size]
+        return piece
+
+
+def read_body(pieces, max_size=0):
+    conn = HTTPConnection(FakeSocket(pieces))
+    conn.set_chunked_body(max_size)
+    body = b""
+    while True:
+        data = conn.recv(1024)
+        if not data:
+            return body, conn
+        body += data
+
+
+class ChunkedBodyTest(unittest.TestCase):
+
+    def test_single_read(self):
+        body, conn = read_body([b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n"])
+        self.assertEqual(body, b"hello world")
+        self.assertTrue(conn.chunked_done)
+
+    def test_split_crlf(self):
+        body, _ = read_body([b"5\r\nhello\r", b"\n0\r\n\r\n"])
+        self.assertEqual(body, b"hello")
+
+    def test_crlf_split_after_data(self):
+        body, _ = read_body([b"5\r\nhello", b"\r", b"\n", b"0\r\n\r\n"])
+        self.assertEqual(body, b"hello")
+
+    def test_split_size_line(self):
+        body, _ = read_body([b"1", b"a;ext=1", b"\r", b"\n" + b"x" * 26 + b"\r\n0\r\n\r\n"])
+        self.assertEqual(body, b"x" * 26)
+
+    def test_extension_after_whitespace(self):
+        body, _ = read_body([b"3 ;name\r\nabc\r\n0\r\n\r\n"])
+        self.assertEqual(body, b"abc")
+
+    def test_invalid_sizes(self):
+        for size in (b"0x1a", b"+5", b"-5", b"1_0", b" 5", b"5 ", b"", b"g"):
+            with self.subTest(size=size):
+                with self.assertRaises(ChunkedEncodingError):
+                    read_body([size + b"\r\n" + b"x" * 32 + b"\r\n0\r\n\r\n"])
+
+    def test_missing_crlf_after_data(self):
+        with self.assertRaises(ChunkedEncodingError):
+            read_body([b"5\r\nhelloXX0\r\n\r\n"])
+
+    def test_closed_inside_body(self):
+        with self.assertRaises(ChunkedEncodingError):
+            read_body([b"5\r\nhel"])
+        with self.assertRaises(ChunkedEncodingError):
+            read_body([b"5\r\nhello\r"])
+
+    def test_trailers(self):
+        body, conn = read_body([b"3\r\nabc\r\n0\r\nChecksum: 123\r\n", b"X-Note:  a b \r\n\r\n"])
+        self.assertEqual(body, b"abc")
+        self.assertEqual(conn.trailers, {"Checksum": "123", "X-Note": "a b"})
+
+    def test_invalid_trailer(self):
+        for trailer in (b"no separator", b" Name: value", b": value"):
+            with self.subTest(trailer=trailer):
+                with self.assertRaises(ChunkedEncodingError):
+                    read_body([b"0\r\n" + trailer + b"\r\n\r\n"])
+
+    def test_body_too_large(self):
+        with self.assertRaises(BodyTooLargeError):
+            read_body([b"5\r\nhello\r\n5\r\nworld\r\n0\r\n\r\n"], max_size=8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import socket
+import threading
+import time
+from http_connection import HTTPConnection
+from log import Log, LogLevel
+
+
+LINGER_READ_SIZE = 16 * 1024
+
+class ConnectionManager:
+
+    def __init__(self, max_connections : int=1024, linger_timeout : float=2.0, linger_size : int=256 * 1024, reap_interval : float=1.0, log : Log=None):
+        self.max_connections = max_connections
+        self.linger_timeout = linger_timeout
+        self.linger_size = linger_size
+        self.reap_interval = reap_interval
+        self.log = log
+        self.connections = dict()
+        self.idle_since = dict()
+        self.reaped = 0
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def start(self):
+        if self.max_connections <= 0:
+            return
+        self.reaper = threading.Thread(target=self._reap_loop, name="connection-reaper")
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    def register(self, conn : HTTPConnection, addr : tuple):
+        with self.lock:
+            self.connections[id(conn)] = (conn, addr)
+
+    def unregister(self, conn : HTTPConnection):
+        with self.lock:
+            self.connections.pop(id(conn), None)
+            self.idle_since.pop(id(conn), None)
+
+    def set_idle(self, conn : HTTPConnection):
+        with self.lock:
+            if id(conn) in self.connections:
+                self.idle_since[id(conn)] = time.monotonic()
+
+    def set_active(self, conn : HTTPConnection):
+        with self.lock:
+            self.idle_since.pop(id(conn), None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "connections": len(self.connections),
+                "idle_connections": len(self.idle_since),
+                "reaped": self.reaped,
+            }
+
+    def close(self, conn : HTTPConnection):
+        # half close and drain, a reset could discard the response the peer has not read yet
+        try:
+            conn.shutdown(socket.SHUT_WR)
+            deadline = time.monotonic() + self.linger_timeout
+            drained = 0
+            while drained < self.linger_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                conn.settimeout(remaining)
+                data = conn.conn.recv(LINGER_READ_SIZE)
+                if not data:
+                    break
+                drained += len(data)
+        except OSError:
+            pass
+        finally:
+            self.unregister(conn)
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            self.reap()
+
+    def reap(self):
+        with self.lock:
+            excess = len(self.connections) - self.max_connections
+            if excess <= 0:
+                return
+            # the longest idle keep-alive connections go first
+            victims = sorted(self.idle_since.items(), key=lambda item: item[1])[:excess]
+            victims = [self.connections[key] for key, _ in victims if key in self.connections]
+            for conn, _ in victims:
+                self.idle_since.pop(id(conn), None)
+            self.reaped += len(victims)
+        for conn, addr in victims:
+            try:
+                # wakes up the thread or event loop waiting for the next request
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if victims and self.log:
+            self.log.log(
+                LogLevel.INFO, f"Reaped {len(victims)} idle connections, {len(self.connections)} open")
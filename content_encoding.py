@@ -0,0 +1,222 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+STREAM_FLUSH_SIZE = 16 * 1024
+ETAG_ENCODING_PATTERN = re.compile(r'-(?:zstd|gzip|deflate)"')
+# hits refresh the modification time of a cached file at most this often, the sweep evicts the oldest
+TOUCH_INTERVAL = 60
+SWEEP_INTERVAL = 60
+
+SUPPORTED_ENCODINGS = (["zstd"] if zstd else []) + ["gzip", "deflate"]
+
+def negotiate(accept_encoding : str) -> str:
+    qualities = dict()
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    best = None
+    best_quality = 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+def is_compressible(content_type : str) -> bool:
+    if not content_type:
+        return False
+    content_type = content_type.split(";")[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def tag_etag(etag : str, encoding : str) -> str:
+    # each representation needs its own validator
+    return etag[:-1] + f'-{encoding}"'
+
+def untag_etags(header : str) -> str:
+    return ETAG_ENCODING_PATTERN.sub('"', header)
+
+def compressobj(encoding : str, level : int):
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return zstd.ZstdCompressor(level=level)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+def compress(data : bytes, encoding : str, level : int=6) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    compressor = compressobj(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(pieces, encoding : str, level : int=6):
+    compressor = compressobj(encoding, level)
+    pending = 0
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode()
+        pending += len(piece)
+        data = compressor.compress(piece)
+        # keep the page rendering progressively instead of buffering it all in the compressor
+        if pending >= STREAM_FLUSH_SIZE:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH if encoding != "zstd" else zstd.ZstdCompressor.FLUSH_BLOCK)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressedFileCache:
+
+    def __init__(self, cache_dir : str, level : int=6, max_file_size : int=64 * 1024 * 1024, read_size : int=1024 * 1024, max_size : int=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.level = level
+        self.max_file_size = max_file_size
+        self.read_size = read_size
+        self.max_size = max_size
+        # estimated bytes in the cache, other worker processes add to it unseen until the next sweep
+        self.size = None
+        self.last_sweep = 0.0
+        self.sweeping = False
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def get_path(self, abs_path : str, stat : os.stat_result, encoding : str) -> str:
+        key = hashlib.blake2b(os.path.abspath(abs_path).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key, f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}.{encoding}")
+
+    def get(self, abs_path : str, stat : os.stat_result, encoding : str, create : bool=True) -> str:
+        if stat.st_size > self.max_file_size:
+            return None
+        path = self.get_path(abs_path, stat, encoding)
+        try:
+            cached = os.stat(path)
+        except OSError:
+            cached = None
+        if cached is not None:
+            now = time.time()
+            if now - cached.st_mtime > TOUCH_INTERVAL:
+                try:
+                    os.utime(path, (now, now))
+                except OSError:
+                    pass
+            return path
+        if not create:
+            return None
+        with self.lock:
+            # another thread is compressing this version, send it uncompressed meanwhile
+            if path in self.pending:
+                return None
+            self.pending.add(path)
+        try:
+            return self._compress(abs_path, stat, encoding, path)
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def _compress(self, abs_path : str, stat : os.stat_result, encoding : str, path : str) -> str:
+        dir = os.path.dirname(path)
+        os.makedirs(dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            compressor = compressobj(encoding, self.level)
+            with open(abs_path, "rb") as source, open(tmp_path, "wb") as target:
+                while True:
+                    data = source.read(self.read_size)
+                    if not data:
+                        break
+                    target.write(compressor.compress(data))
+                target.write(compressor.flush())
+            current = os.stat(abs_path)
+            if (current.st_ino, current.st_size, current.st_mtime_ns) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+                # the file changed while it was compressed
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        self._remove_stale(dir, os.path.basename(path))
+        self._account(os.path.getsize(path))
+        return path
+
+    def _account(self, size : int):
+        if not self.max_size:
+            return
+        with self.lock:
+            if self.size is not None:
+                self.size += size
+            due = self.size is None or self.size > self.max_size or time.monotonic() - self.last_sweep > SWEEP_INTERVAL
+            if not due or self.sweeping:
+                return
+            self.sweeping = True
+        try:
+            self.sweep()
+        finally:
+            with self.lock:
+                self.sweeping = False
+
+    def sweep(self):
+        # least recently used files go first until the cache is back under 90% of its budget
+        entries = []
+        for dir, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                # the key directory is left behind empty once its last version is gone
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        with self.lock:
+            self.size = total
+            self.last_sweep = time.monotonic()
+
+    def _remove_stale(self, dir : str, current : str):
+        version = current.rsplit(".", 1)[0]
+        for name in os.listdir(dir):
+            if name.endswith(".tmp") or name.rsplit(".", 1)[0] == version:
+                continue
+            try:
+                os.remove(os.path.join(dir, name))
+            except OSError:
+                pass
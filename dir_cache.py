@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+
+ENTRY_OVERHEAD = 128
+
+def iter_entries(abs_dir : str) -> Iterator[tuple]:
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    yield (entry.name, True, -1, -1)
+                else:
+                    stat = entry.stat()
+                    yield (entry.name, False, stat.st_size, stat.st_mtime)
+            except OSError:
+                # broken symbolic link
+                yield (entry.name, False, 0, -1)
+
+def weak_etag(text : str) -> str:
+    return 'W/"' + hashlib.blake2b(text.encode(), digest_size=12).hexdigest() + '"'
+
+class DirectoryListing:
+
+    def __init__(self, version : tuple, entries : list):
+        self.version = version
+        self.scan_time = time.monotonic()
+        self.entries = entries
+        self.rendered = dict()
+        self.orders = dict()
+        self.size = sum(len(entry[0]) + ENTRY_OVERHEAD for entry in entries)
+        # the listing changes with the directory itself and with the size of its files
+        self.last_modified = max([version[1] / 1e9] + [entry[3] for entry in entries])
+
+
+class DirectoryCache:
+
+    def __init__(self, max_bytes : int=64 * 1024 * 1024, max_age : float=30.0):
+        self.max_bytes = max_bytes
+        # file sizes change without touching the directory mtime
+        self.max_age = max_age
+        self.listings = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_version(abs_dir : str) -> tuple:
+        stat = os.stat(abs_dir)
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    @staticmethod
+    def scan(abs_dir : str) -> list:
+        entries = list(iter_entries(abs_dir))
+        entries.sort(key=lambda x: (not x[1], x[0] + "/" if x[1] else x[0]))
+        return entries
+
+    def get_listing(self, abs_dir : str, revalidate : bool=False) -> DirectoryListing:
+        key = os.path.abspath(abs_dir)
+        version = self.get_version(key)
+        with self.lock:
+            cached = self.listings.get(key)
+            if cached is not None and cached.version == version and time.monotonic() - cached.scan_time < self.max_age:
+                self.listings.move_to_end(key)
+                if not revalidate:
+                    return cached
+            else:
+                cached = None
+        entries = self.scan(key)
+        if cached is not None and entries == cached.entries:
+            # the files did not change either, the rendered pages and sort orders stay valid
+            cached.scan_time = time.monotonic()
+            return cached
+        listing = DirectoryListing(version, entries)
+        # a change during the scan may share the old mtime, do not cache it
+        if self.get_version(key) == version:
+            with self.lock:
+                old = self.listings.pop(key, None)
+                if old is not None:
+                    self.total_bytes -= old.size
+                self.listings[key] = listing
+                self.total_bytes += listing.size
+                self._evict()
+        return listing
+
+    def get_rendered(self, abs_dir : str, variant : tuple, render : Callable[[list], str], revalidate : bool=False) -> (str, str, float):
+        listing = self.get_listing(abs_dir, revalidate)
+        rendered = listing.rendered.get(variant)
+        if rendered is None:
+            text = render(listing.entries)
+            rendered = (text, weak_etag(text))
+            with self.lock:
+                if variant not in listing.rendered:
+                    listing.rendered[variant] = rendered
+                    self._grow(abs_dir, listing, len(text))
+        return rendered[0], rendered[1], listing.last_modified
+
+    def get_sorted(self, abs_dir : str, order : str, key : Callable[[tuple], tuple]) -> (DirectoryListing, list, list):
+        listing = self.get_listing(abs_dir)
+        sorted_entries = listing.orders.get(order)
+        if sorted_entries is None:
+            entries = sorted(listing.entries, key=key)
+            sorted_entries = (entries, [key(entry) for entry in entries])
+            with self.lock:
+                if order not in listing.orders:
+                    listing.orders[order] = sorted_entries
+                    self._grow(abs_dir, listing, len(entries) * ENTRY_OVERHEAD)
+        return listing, sorted_entries[0], sorted_entries[1]
+
+    def _grow(self, abs_dir : str, listing : DirectoryListing, size : int):
+        listing.size += size
+        if self.listings.get(os.path.abspath(abs_dir)) is listing:
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.listings) > 1:
+            _, listing = self.listings.popitem(last=False)
+            self.total_bytes -= listing.size
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import hashlib
+import os
+import struct
+import time
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+NONCE_SIZE = 16
+TICKET_EXPIRE = struct.Struct("!Q")
+
+def derive_key(master_key : bytes, client_nonce : bytes, server_nonce : bytes) -> (bytes, bytes):
+    # a resumed connection never reuses the key and iv of an earlier one
+    key = hashlib.sha256(b"key" + master_key + client_nonce + server_nonce).digest()
+    iv = hashlib.sha256(b"iv" + master_key + client_nonce + server_nonce).digest()[:16]
+    return key, iv
+
+
+class SessionTicketIssuer:
+
+    def __init__(self, lifetime : float=3600):
+        self.lifetime = lifetime
+        # created before forking, so every worker process accepts the tickets of the others
+        self.aead = AESGCM(AESGCM.generate_key(bit_length=256))
+
+    def issue(self, master_key : bytes) -> str:
+        nonce = os.urandom(12)
+        expire = TICKET_EXPIRE.pack(int(time.time() + self.lifetime))
+        sealed = self.aead.encrypt(nonce, master_key, expire)
+        return base64.urlsafe_b64encode(nonce + expire + sealed).decode()
+
+    def open(self, ticket : str) -> bytes:
+        try:
+            data = base64.urlsafe_b64decode(ticket.strip())
+        except (binascii.Error, ValueError):
+            return None
+        if len(data) < 12 + TICKET_EXPIRE.size:
+            return None
+        nonce = data[:12]
+        expire = data[12:12 + TICKET_EXPIRE.size]
+        if TICKET_EXPIRE.unpack(expire)[0] < time.time():
+            return None
+        try:
+            return self.aead.decrypt(nonce, data[12 + TICKET_EXPIRE.size:], expire)
+        except InvalidTag:
+            return None
@@ -11,7 +11,7 @@ def prepare_request(method, uri, protocol, headers, body):
     data += "\r\n"
     data = data.encode()
     if body:
-        data += body + b"\r\n\r\n"
+        data += body
     return data
 
 def send_and_receive(send_packet : bytes, conn : socket.socket, send_aes_en : AESEncryptor=None, recv_aes_en : AESEncryptor=None, debug : bool=False):
@@ -35,7 +35,7 @@ def send_and_receive(send_packet : bytes, conn : socket.socket, send_aes_en : AE
     headers = dict([header.split(": ") for header in headers[1:]])
     body = data[1]
     if len(body) < int(headers["Content-Length"]):
-        data = conn.recv(int(headers["Content-Length"]) - len(body) + len(b'\r\n\r\n'))[:-len(b'\r\n\r\n')]
+        data = conn.recv(int(headers["Content-Length"]) - len(body))
         if recv_aes_en:
             if debug:
                 print("Encrypted Data:", data)
@@ -1,40 +1,285 @@
+import re
 import socket
+import ssl
+import time
 from aes_encryptor import AESEncryptor
 
+
+RECV_SIZE = 64 * 1024
+IOV_MAX = 512
+MAX_CHUNK_LINE_SIZE = 4096
+MAX_TRAILER_SIZE = 16 * 1024
+CHUNK_SIZE_PATTERN = re.compile(rb"[0-9a-fA-F]+")
+
+class HeaderTooLargeError(Exception):
+    pass
+
+class BodyError(Exception):
+    pass
+
+class ChunkedEncodingError(BodyError):
+    pass
+
+class BodyTooLargeError(BodyError):
+    pass
+
 class HTTPConnection:
 
     def __init__(self, conn : socket.socket, encryptor : AESEncryptor=None):
         self.conn = conn
         self.encryptor = encryptor
-        
-    def recv(self, size : int) -> bytes:
-        data = self.conn.recv(size)
+        self.buffer = bytearray()
+        self.body_remaining = None
+        self.chunked = False
+        self.chunk_remaining = 0
+        self.chunked_done = False
+        self.body_received = 0
+        self.max_body_size = 0
+        self.trailers = dict()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.request = None
+        self.trace = None
+        self.throttle = None
+        self.header_deadline = None
+        try:
+            # responses are written in few large calls, waiting for delayed acks only adds latency
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def _recv_raw(self, size : int) -> bytes:
+        while True:
+            data = self.conn.recv(size)
+            self.bytes_received += len(data)
+            if not self.encryptor or not data:
+                return data
+            data = self.encryptor.decrypt(data)
+            # record ciphers yield nothing until a whole record has arrived
+            if data:
+                return data
+
+    def feed(self, data : bytes):
+        # bytes an event loop read from the socket on behalf of the next request
+        self.bytes_received += len(data)
         if self.encryptor:
             data = self.encryptor.decrypt(data)
+        self.buffer += data
+
+    def _read(self, size : int) -> bytes:
+        if self.buffer:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        else:
+            data = self._recv_raw(size)
+            if len(data) > size:
+                self.buffer += data[size:]
+                data = data[:size]
+        return data
+
+    def recv(self, size : int) -> bytes:
+        if self.chunked:
+            return self._recv_chunked(size)
+        if self.body_remaining is not None:
+            size = min(size, self.body_remaining)
+            if size <= 0:
+                return b""
+        data = self._read(size)
+        if self.body_remaining is not None:
+            self.body_remaining -= len(data)
+        return data
+
+    def _read_line(self, max_size : int) -> bytes:
+        try:
+            line = self.read_until(b"\r\n", max_size)
+        except HeaderTooLargeError as e:
+            raise ChunkedEncodingError(f"chunk line too long: {e}")
+        if line is None:
+            raise ChunkedEncodingError("connection closed inside the chunked body")
+        return line
+
+    def _recv_chunked(self, size : int) -> bytes:
+        if self.chunked_done or size <= 0:
+            return b""
+        if self.chunk_remaining == 0:
+            # chunk extensions after ; are ignored, only they may be preceded by whitespace
+            line, separator, _ = self._read_line(MAX_CHUNK_LINE_SIZE).partition(b";")
+            if separator:
+                line = line.rstrip(b" \t")
+            if not CHUNK_SIZE_PATTERN.fullmatch(line):
+                raise ChunkedEncodingError(f"invalid chunk size {line[:32]!r}")
+            chunk_size = int(line, 16)
+            if chunk_size == 0:
+                self._read_trailers()
+                return b""
+            if self.max_body_size and self.body_received + chunk_size > self.max_body_size:
+                raise BodyTooLargeError(f"chunked body exceeds the limit of {self.max_body_size} bytes")
+            self.chunk_remaining = chunk_size
+        data = self._read(min(size, self.chunk_remaining))
+        if not data:
+            raise ChunkedEncodingError("connection closed inside the chunked body")
+        self.chunk_remaining -= len(data)
+        self.body_received += len(data)
+        if self.chunk_remaining == 0:
+            # the CRLF may arrive split over several reads
+            while len(self.buffer) < 2:
+                received = self._recv_raw(RECV_SIZE)
+                if not received:
+                    raise ChunkedEncodingError("connection closed inside the chunked body")
+                self.buffer += received
+            if self.buffer[:2] != b"\r\n":
+                raise ChunkedEncodingError("chunk data is not followed by CRLF")
+            del self.buffer[:2]
         return data
-    
+
+    def _read_trailers(self):
+        size = 0
+        while True:
+            line = self._read_line(MAX_TRAILER_SIZE)
+            if not line:
+                break
+            size += len(line) + 2
+            if size > MAX_TRAILER_SIZE:
+                raise ChunkedEncodingError(f"trailers exceed the limit of {MAX_TRAILER_SIZE} bytes")
+            name, separator, value = line.decode("latin-1").partition(":")
+            if not separator or not name or name != name.strip():
+                raise ChunkedEncodingError(f"invalid trailer line {line[:32]!r}")
+            self.trailers[name] = value.strip()
+        self.chunked_done = True
+
+    def drain_body(self, max_size : int) -> bool:
+        # reads a small unread rest of the body, returns whether the next request can follow
+        if self.chunked:
+            drained = 0
+            while drained <= max_size:
+                data = self.recv(RECV_SIZE)
+                if not data:
+                    return True
+                drained += len(data)
+            return False
+        if self.body_remaining and self.body_remaining <= max_size:
+            while self.recv(self.body_remaining):
+                pass
+        return not self.body_remaining
+
+    def recv_buffered(self) -> bytes:
+        if self.chunked:
+            # the buffer still holds the chunk framing, handlers read the body through recv
+            return b""
+        size = len(self.buffer)
+        if self.body_remaining is not None:
+            size = min(size, self.body_remaining)
+        if size <= 0:
+            return b""
+        return self.recv(size)
+
+    def read_until(self, delimiter : bytes, max_size : int, skip : bytes=None, timeout : float=None, deadline : float=None) -> bytes:
+        start = 0
+        while True:
+            if skip:
+                while self.buffer.startswith(skip):
+                    del self.buffer[:len(skip)]
+                    start = 0
+            index = self.buffer.find(delimiter, start)
+            if index != -1:
+                if index > max_size:
+                    raise HeaderTooLargeError(f"{index} bytes exceed the limit of {max_size} bytes")
+                data = bytes(self.buffer[:index])
+                del self.buffer[:index + len(delimiter)]
+                return data
+            if len(self.buffer) > max_size:
+                raise HeaderTooLargeError(f"{len(self.buffer)} bytes exceed the limit of {max_size} bytes")
+            start = max(0, len(self.buffer) - len(delimiter) + 1)
+            if timeout is not None and deadline is None and self.buffer:
+                # the whole block has to arrive within timeout once its first byte is here
+                deadline = time.monotonic() + timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("timed out")
+                self.conn.settimeout(remaining)
+            data = self._recv_raw(RECV_SIZE)
+            if not data:
+                return None
+            self.buffer += data
+
+    def has_buffered_data(self) -> bool:
+        if isinstance(self.conn, ssl.SSLSocket) and self.conn.pending() > 0:
+            # decrypted by OpenSSL but not read yet, the socket will not become readable for it
+            return True
+        return len(self.buffer) > 0
+
+    def set_body_length(self, length : int):
+        self.body_remaining = length
+        self.chunked = False
+
+    def set_chunked_body(self, max_size : int=0):
+        self.body_remaining = None
+        self.chunked = True
+        self.chunk_remaining = 0
+        self.chunked_done = False
+        self.body_received = 0
+        self.max_body_size = max_size
+        self.trailers = dict()
+
     def get_conn(self) -> socket.socket:
         return self.conn
-    
+
     def getpeername(self):
         return self.conn.getpeername()
-    
+
     def sendall(self, data : bytes):
         if self.encryptor:
             data = self.encryptor.encrypt(data)
         self.conn.sendall(data)
-    
+        self.bytes_sent += len(data)
+
     def send(self, data : bytes):
         if self.encryptor:
             data = self.encryptor.encrypt(data)
-        self.conn.send(data)
+        sent = self.conn.send(data)
+        self.bytes_sent += sent
+        return sent
+
+    def sendmsg(self, buffers : list):
+        # ssl sockets do not support vectored writes
+        if self.encryptor or isinstance(self.conn, ssl.SSLSocket):
+            self.sendall(b"".join(buffers))
+            return
+        buffers = [memoryview(buffer) for buffer in buffers if buffer]
+        while buffers:
+            sent = self.conn.sendmsg(buffers[:IOV_MAX])
+            self.bytes_sent += sent
+            # drop the fully written buffers and keep the rest of a partial one
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+    def supports_sendfile(self) -> bool:
+        # ssl sockets fall back to small send calls, kernel TLS is not used
+        return not self.encryptor and not isinstance(self.conn, ssl.SSLSocket)
+
+    def sendfile(self, file, offset : int=0, count : int=None) -> int:
+        if self.encryptor:
+            raise ValueError("sendfile is not supported on encrypted connections")
+        sent = self.conn.sendfile(file, offset, count)
+        self.bytes_sent += sent
+        return sent
 
     def settimeout(self, timeout : float):
         self.conn.settimeout(timeout)
 
+    def shutdown(self, how : int):
+        self.conn.shutdown(how)
+
     def close(self):
         self.conn.close()
 
     def set_encryptor(self, encryptor : AESEncryptor):
         self.encryptor = encryptor
-    
\ No newline at end of file
+        if self.buffer:
+            # bytes pipelined after the handshake are already encrypted
+            self.buffer = bytearray(encryptor.decrypt(bytes(self.buffer)))
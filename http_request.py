@@ -31,7 +31,7 @@ class HTTPRequest:
         else:
             protocol = "HTTP/1.1"
         headers = headers[1:]
-        headers = dict([header.split(": ") for header in headers])
+        headers = dict([header.split(": ", 1) for header in headers])
         return cls(method, uri, parameters, protocol, headers, part_body, index)
 
     def __init__(self, method : HTTPMethod, uri : str, parameters : dict, protocol : str, headers : dict, body : bytes, cursor : int):
@@ -7,12 +7,18 @@ from http_connection import HTTPConnection
 from typing import Union
 
 
-DOWNLOAD_SPEED = 1024 * 1024 * 100
+# size of the frames of chunked file responses
+FILE_CHUNK_SIZE = 1024 * 1024
+# reads of files that cannot be sent with sendfile stay small to bound the memory of every transfer
+USERSPACE_READ_SIZE = 256 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+VECTOR_PART_SIZE = 64 * 1024
 
 class HTTPBodyType(enum.Enum):
     EMPTY = "empty"
     TEXT = "text"
     FILE = "file"
+    STREAM = "stream"
 
 class HTTPResponse:
 
@@ -96,12 +102,53 @@ class HTTPResponse:
         return "".join(response_builder)
 
     
+    def _send_file(self, conn : Union[socket.socket, HTTPConnection], file, offset : int, count : int):
+        if isinstance(conn, HTTPConnection) and conn.throttle:
+            self._send_file_throttled(conn, file, offset, count)
+            return
+        if isinstance(conn, HTTPConnection) and not conn.supports_sendfile():
+            # encrypted data has to pass through userspace
+            while count > 0:
+                data = os.pread(file.fileno(), min(count, USERSPACE_READ_SIZE), offset)
+                if not data:
+                    break
+                conn.sendall(data)
+                offset += len(data)
+                count -= len(data)
+            return
+        # zero-copy transfer from the page cache to the socket
+        conn.sendfile(file, offset, count)
+
+    def _send_file_throttled(self, conn : HTTPConnection, file, offset : int, count : int):
+        quantum = conn.throttle.quantum()
+        zero_copy = conn.supports_sendfile()
+        while count > 0:
+            size = min(count, quantum)
+            conn.throttle.wait(size)
+            if zero_copy:
+                sent = conn.sendfile(file, offset, size)
+            else:
+                data = os.pread(file.fileno(), size, offset)
+                conn.sendall(data)
+                sent = len(data)
+            if not sent:
+                break
+            offset += sent
+            count -= sent
+
+    def _send_buffers(self, conn : Union[socket.socket, HTTPConnection], buffers : list):
+        if isinstance(conn, HTTPConnection):
+            conn.sendmsg(buffers)
+        else:
+            conn.sendall(b"".join(buffers))
+
     def send(self, conn : Union[socket.socket, HTTPConnection]):
         date = utils.get_current_time().strftime("%a, %d %b %Y %H:%M:%S GMT")
         self.headers["Date"] = date
 
         if (self.body[0] == HTTPBodyType.EMPTY):
-            self.headers["Content-Length"] = 0
+            if self.status_code != 304:
+                self.headers["Content-Length"] = 0
             conn.sendall(self._build_headers().encode())
             return
         
@@ -109,9 +156,33 @@ class HTTPResponse:
             if isinstance(self.body[1], str):
                 self.body = (self.body[0], self.body[1].encode())
             self.headers["Content-Length"] = len(self.body[1])
-            conn.sendall(self._build_headers().encode())
-            conn.sendall(self.body[1] + b"\r\n\r\n")
+            if self.is_head:
+                conn.sendall(self._build_headers().encode())
+                return
+            self._send_buffers(conn, [self._build_headers().encode(), self.body[1]])
+
+            return
 
+        if (self.body[0] == HTTPBodyType.STREAM):
+            self.headers["Transfer-Encoding"] = "chunked"
+            conn.sendall(self._build_headers().encode())
+            if self.is_head:
+                return
+            pieces = []
+            size = 0
+            for piece in self.body[1]:
+                if isinstance(piece, str):
+                    piece = piece.encode()
+                pieces.append(piece)
+                size += len(piece)
+                # coalesce the many small template fragments into larger chunks
+                if size >= STREAM_CHUNK_SIZE:
+                    conn.sendall(f"{size:X}\r\n".encode() + b"".join(pieces) + b"\r\n")
+                    pieces = []
+                    size = 0
+            if size > 0:
+                conn.sendall(f"{size:X}\r\n".encode() + b"".join(pieces) + b"\r\n")
+            conn.sendall(b"0\r\n\r\n")
             return
 
         if (self.body[0] == HTTPBodyType.FILE):
@@ -119,7 +190,9 @@ class HTTPResponse:
             with open(file_path, "rb") as file:
                 file_size = os.path.getsize(file_path)
 
-                self.headers["Accept-Ranges"] = "bytes"
+                if "Content-Encoding" not in self.headers:
+                    # ranges are only served from the uncompressed file
+                    self.headers["Accept-Ranges"] = "bytes"
                 # range transfer
                 if self.ranges:
                     self.status_code = 206
@@ -127,43 +200,40 @@ class HTTPResponse:
                     boundary = "CS305v" + "{:05}".format(random.randint(0, 99999))
                     origin_content_type = self.headers["Content-Type"]
                     use_boundary = len(self.ranges) > 1
-                    if use_boundary:
-                        self.headers["Content-Type"] += f"multipart/byteranges; boundary={boundary}"
-                    content_ranges = "bytes " + ",".join([f"{start}-{end}/{file_size}" for start, end in self.ranges])
-                    self.headers["Content-Range"] = content_ranges
-                    self.headers["Content-Length"] = self.ranges[0][1] - self.ranges[0][0] + 1
-                    _content_length = 0
+                    parts = []
                     for start, end in self.ranges:
+                        part_header = b""
                         if use_boundary:
-                            _content_length += len(b"--" + boundary.encode() + b"\r\n")
-                            _content_length += len(b"Content-Type: " + origin_content_type.encode() + b"\r\n")
-                            _content_length += len(b"Content-Range: bytes " + str(start).encode() + b"-" + str(end).encode() + b"/" + str(file_size).encode() + b"\r\n")
-                            _content_length += len(b"Content-Length: " + str(end - start + 1).encode() + b"\r\n")
-                            _content_length += len(b"\r\n")
-                        _content_length += end - start + 1
-                        _content_length += len(b'\r\n\r\n')
+                            part_header = (f"--{boundary}\r\n"
+                                           f"Content-Type: {origin_content_type}\r\n"
+                                           f"Content-Range: bytes {start}-{end}/{file_size}\r\n"
+                                           f"Content-Length: {end - start + 1}\r\n\r\n").encode()
+                        parts.append((part_header, start, end - start + 1))
+                    closing = f"--{boundary}--\r\n".encode() if use_boundary else b""
                     if use_boundary:
-                        _content_length += len(b"--" + boundary.encode() + b"--")
-                    self.headers["Content-Length"] = _content_length
-                    conn.sendall(self._build_headers().encode())
+                        self.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+                        self.headers["Content-Length"] = sum(len(header) + count + 2 for header, _, count in parts) + len(closing)
+                    else:
+                        self.headers["Content-Range"] = f"bytes {self.ranges[0][0]}-{self.ranges[0][1]}/{file_size}"
+                        self.headers["Content-Length"] = parts[0][2]
+                    buffers = [self._build_headers().encode()]
                     if self.is_head:
+                        conn.sendall(buffers[0])
                         return
-                    for start, end in self.ranges:
+                    for part_header, start, count in parts:
+                        buffers.append(part_header)
+                        # throttled parts all go through _send_file to be paced
+                        if count <= VECTOR_PART_SIZE and not (isinstance(conn, HTTPConnection) and conn.throttle):
+                            buffers.append(os.pread(file.fileno(), count, start))
+                        else:
+                            # large parts go through sendfile, flush the pending headers first
+                            self._send_buffers(conn, buffers)
+                            buffers = []
+                            self._send_file(conn, file, start, count)
                         if use_boundary:
-                            conn.sendall(b"--" + boundary.encode() + b"\r\n")
-                            conn.sendall(f"Content-Type: {origin_content_type}".encode() + b"\r\n")
-                            conn.sendall(f"Content-Range: bytes {start}-{end}/{file_size}".encode() + b"\r\n")
-                            conn.sendall(f"Content-Length: {end - start + 1}".encode() + b"\r\n")
-                            conn.sendall(b"\r\n")
-                        file.seek(start)
-                        rest_data_len = end - start + 1
-                        while rest_data_len > 0:
-                            data = file.read(min(rest_data_len, DOWNLOAD_SPEED))
-                            conn.sendall(data)
-                            rest_data_len -= min(rest_data_len, DOWNLOAD_SPEED)
-                        conn.sendall(b"\r\n\r\n")
-                    if use_boundary:
-                        conn.sendall(b"--" + boundary.encode() + b"--\r\n\r\n")
+                            buffers.append(b"\r\n")
+                    buffers.append(closing)
+                    self._send_buffers(conn, buffers)
                     return
                 else:
                     
@@ -176,15 +246,13 @@ class HTTPResponse:
                         # print(headers_str)
                         if self.is_head:
                             return
-                        while True:
-                            data = file.read(DOWNLOAD_SPEED)
-                            if not data:
-                                break
-                            conn.sendall(f"{len(data):X}\r\n".encode())
-                            conn.sendall(data)
+                        offset = 0
+                        while offset < file_size:
+                            chunk_size = min(file_size - offset, FILE_CHUNK_SIZE)
+                            conn.sendall(f"{chunk_size:X}\r\n".encode())
+                            self._send_file(conn, file, offset, chunk_size)
                             conn.sendall(b"\r\n")
-                            if len(data) < DOWNLOAD_SPEED:
-                                break
+                            offset += chunk_size
                         conn.sendall(b"0\r\n\r\n")
                         return
                     else:
@@ -194,13 +262,7 @@ class HTTPResponse:
                         conn.sendall(self._build_headers().encode())
                         if self.is_head:
                             return
-                        file.seek(0)
-                        rest_data_len = file_size
-                        while rest_data_len > 0:
-                            data = file.read(min(rest_data_len, DOWNLOAD_SPEED))
-                            conn.sendall(data)
-                            rest_data_len -= min(rest_data_len, DOWNLOAD_SPEED)
-                        conn.sendall(b"\r\n\r\n")
+                        self._send_file(conn, file, 0, file_size)
                         return
 
 
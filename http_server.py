@@ -1,26 +1,41 @@
 import socket
+import ssl
 import threading
 import mimetypes
 import os
 import base64
 import utils
 import datetime
+import json
+import time
 from http_request import HTTPRequest, HTTPMethod
 from http_response import HTTPResponse, HTTPBodyType
-from http_connection import HTTPConnection
+from http_connection import HTTPConnection, HeaderTooLargeError, ChunkedEncodingError, BodyTooLargeError
 from rsa_encryptor import RSAEncryptor
-from aes_encryptor import AESEncryptor
+from aes_encryptor import AESEncryptor, ENCRYPT_MODES, create_encryptor
+from encrypt_session import SessionTicketIssuer, NONCE_SIZE, derive_key
 from log import Log, LogLevel
+from async_engine import AsyncEngine
+from worker_pool import WorkerPool, OverflowPolicy
+from multipart import MultipartParser, MultipartError
+from session_cache import SessionCache
+from connection_manager import ConnectionManager
+from ttl_cache import TTLCache
+from bandwidth import BandwidthLimiter
+from upload_session import UploadSessionStore, UploadSessionError, RESERVED_NAMES, format_ranges, parse_content_range
+from content_encoding import CompressedFileCache
+import content_encoding
+import metrics
+import tracing
 import uuid as ud
-import tempfile
-import time
 
 
 class HTTPServer:
 
-    def __init__(self, host: str = "localhost", port: int = 8080, parallel: int = 5, timeout: int = 10, cookie_persist_time: int = 3600, debug: bool = False, server: str = "CS305 HTTP Server/1.0", upload_chunk_size: int = 1024 * 1024 * 100):
+    def __init__(self, host: str = "localhost", port: int = 8080, parallel: int = 5, timeout: int = 10, cookie_persist_time: int = 3600, debug: bool = False, server: str = "CS305 HTTP Server/1.0", upload_chunk_size: int = 256 * 1024, engine: str = "thread", pool_min_workers: int = 4, pool_max_workers: int = 32, pool_queue_size: int = 64, pool_overflow: str = "block", retry_after: int = 5, pool_stats_interval: float = 60, async_workers: int = 32, reuse_port: bool = False, max_header_size: int = 64 * 1024, max_header_count: int = 100, session_cache_size: int = 10000, session_flush_interval: float = 5.0, listing_page_size: int = 1000, listing_max_page_size: int = 10000, log_level: str = "INFO", log_max_bytes: int = 0, log_rotate_interval: float = 0, log_backup_count: int = 5, compression: bool = True, compression_min_size: int = 1024, compression_level: int = 6, compression_cache_dir: str = "cache", compression_max_file_size: int = 64 * 1024 * 1024, compression_cache_size: int = 1024 * 1024 * 1024, encrypt_session_lifetime: float = 3600, tls_port: int = None, tls_cert: str = None, tls_key: str = None, idle_timeout: float = None, header_timeout: float = 10, max_requests: int = 100, max_connections: int = 1024, linger_timeout: float = 2.0, expose_metrics: bool = False, admin_host: str = "127.0.0.1", admin_port: int = None, slow_request_threshold: float = 1.0, profile_dir: str = "profiles", connection_rate_limit: int = 0, user_rate_limit: int = 0, global_rate_limit: int = 0, upload_session_dir: str = "uploads", upload_session_lifetime: float = 24 * 3600, upload_max_length: int = 64 * 1024 ** 3, max_body_size: int = 0, remove_duplicate_users: bool = False):
         self.log = Log(
-            f"logs{os.path.sep}log_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+            f"logs{os.path.sep}log_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log",
+            level=LogLevel[log_level.upper()], max_bytes=log_max_bytes, rotate_interval=log_rotate_interval, backup_count=log_backup_count)
         self.host = host
         self.port = port
         self.debug = debug
@@ -29,16 +44,237 @@ class HTTPServer:
         self.server = server
         self.upload_chunk_size = upload_chunk_size
         self.cookie_persist_time = cookie_persist_time
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((self.host, self.port))
-        self.socket.listen(self.parallel)
+        self.engine = engine
+        self.pool_min_workers = pool_min_workers
+        self.pool_max_workers = pool_max_workers
+        self.async_workers = async_workers
+        self.pool_queue_size = pool_queue_size
+        self.pool_overflow = OverflowPolicy(pool_overflow)
+        self.pool_stats_interval = pool_stats_interval
+        self.retry_after = retry_after
+        self.worker_pool = None
+        self.reuse_port = reuse_port
+        self.max_header_size = max_header_size
+        self.max_header_count = max_header_count
+        self.listing_page_size = listing_page_size
+        self.listing_max_page_size = listing_max_page_size
+        self.sessions = SessionCache(max_size=session_cache_size, flush_interval=session_flush_interval)
+        self.compression = compression
+        self.compression_min_size = compression_min_size
+        self.compression_level = compression_level
+        self.compressed_files = CompressedFileCache(os.path.join(compression_cache_dir, "compressed"), level=compression_level, max_file_size=compression_max_file_size, max_size=compression_cache_size)
+        self.compressed_texts = TTLCache(max_size=256, ttl=300)
+        self.encrypt_tickets = SessionTicketIssuer(lifetime=encrypt_session_lifetime)
+        self.tls_port = tls_port
+        self.tls_context = self.create_tls_context(tls_cert, tls_key) if tls_port else None
+        self.tls_socket = None
+        self.idle_timeout = idle_timeout if idle_timeout is not None else timeout
+        self.header_timeout = header_timeout
+        self.max_requests = max_requests
+        self.connections = ConnectionManager(max_connections=max_connections, linger_timeout=linger_timeout, log=self.log)
+        self.expose_metrics = expose_metrics
+        self.admin_host = admin_host
+        self.admin_port = admin_port
+        self.admin_socket = None
+        self.admin_routes = {"/metrics": self.handle_metrics, "/profile": self.handle_profile}
+        self.slow_request_threshold = slow_request_threshold
+        self.profiler = tracing.Profiler(profile_dir, log=self.log)
+        self.bandwidth = BandwidthLimiter(connection_rate=connection_rate_limit, user_rate=user_rate_limit, global_rate=global_rate_limit)
+        self.upload_sessions = UploadSessionStore(upload_session_dir, lifetime=upload_session_lifetime, max_length=upload_max_length)
+        self.max_body_size = max_body_size
+        self.register_metrics()
+        self.create_socket()
+
+        try:
+            utils.init_sql(self.log, remove_duplicate_users)
+        except utils.DuplicateUserError:
+            # the conflicting users are logged, the accounts are left for the operator to sort out
+            raise SystemExit(1)
+
+    def create_socket(self):
+        self.socket = self.create_listener(self.port)
+        if self.tls_port:
+            self.tls_socket = self.create_listener(self.tls_port)
+        if self.admin_port:
+            self.admin_socket = self.create_listener(self.admin_port, self.admin_host)
+
+    def create_listener(self, port: int, host: str = None) -> socket.socket:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((host or self.host, port))
+        listener.listen(self.parallel)
+        return listener
+
+    def close_sockets(self):
+        self.socket.close()
+        if self.tls_socket:
+            self.tls_socket.close()
+        if self.admin_socket:
+            self.admin_socket.close()
+
+    def register_metrics(self):
+        def connection_states():
+            stats = self.connections.stats()
+            return {("active",): stats["connections"] - stats["idle_connections"], ("idle",): stats["idle_connections"]}
+        def worker_states():
+            if not self.worker_pool:
+                return dict()
+            stats = self.worker_pool.stats()
+            return {("busy",): stats["busy_workers"], ("idle",): stats["workers"] - stats["busy_workers"]}
+        def worker_pool_stat(name: str):
+            return lambda: {(): self.worker_pool.stats()[name]} if self.worker_pool else dict()
+        metrics.REGISTRY.gauge_callback("http_connections", "Open client connections", connection_states, ("state",))
+        metrics.REGISTRY.gauge_callback("http_connections_reaped", "Idle keep-alive connections closed above --max-connections",
+                                        lambda: {(): self.connections.stats()["reaped"]})
+        metrics.REGISTRY.gauge_callback("worker_pool_workers", "Worker threads of the pool engine", worker_states, ("state",))
+        metrics.REGISTRY.gauge_callback("worker_pool_queue_depth", "Accepted connections waiting for a worker", worker_pool_stat("queue_depth"))
+        metrics.REGISTRY.gauge_callback("worker_pool_rejected", "Connections rejected because the pool was full", worker_pool_stat("rejected"))
+        metrics.REGISTRY.gauge_callback("session_cache_entries", "Cached login sessions", lambda: {(): len(self.sessions.sessions)})
+
+    def accept_admin(self):
+        while True:
+            conn, addr = self.admin_socket.accept()
+            new_thread = threading.Thread(
+                target=self.handle_admin_connection, args=(conn, addr))
+            new_thread.daemon = True
+            new_thread.start()
+
+    def handle_admin_connection(self, conn: socket.socket, addr: tuple):
+        conn = HTTPConnection(conn)
+        try:
+            conn.settimeout(self.timeout)
+            headers_data = conn.read_until(b"\r\n\r\n", self.max_header_size, skip=b"\r\n")
+            if headers_data is None:
+                return
+            http_request = HTTPRequest.build_by_headers(headers_data.decode("utf-8"), b"", 0)
+            handler = self.admin_routes.get(http_request.get_uri())
+            if handler is None:
+                response = HTTPResponse.build(server=self.server, status_code=404, reason="Not Found")
+            elif http_request.get_method() not in (HTTPMethod.GET, HTTPMethod.HEAD):
+                response = HTTPResponse.build(server=self.server, status_code=405, reason="Method Not Allowed")
+            else:
+                response = handler(http_request)
+                response.is_head = http_request.get_method() == HTTPMethod.HEAD
+            response.headers["Connection"] = "Close"
+            response.send(conn)
+        except Exception as e:
+            self.log.log(LogLevel.ERROR, f"Admin request from {addr[0]}:{addr[1]} failed: {e}")
+        finally:
+            conn.close()
+
+    def handle_metrics(self, http_request: HTTPRequest) -> HTTPResponse:
+        return HTTPResponse.build(server=self.server, status_code=200, reason="OK",
+                                  content_type="text/plain; version=0.0.4; charset=utf-8",
+                                  body=(HTTPBodyType.TEXT, metrics.REGISTRY.render()))
+
+    def handle_profile(self, http_request: HTTPRequest) -> HTTPResponse:
+        mode = http_request.parameters.get("mode", "cprofile")
+        try:
+            seconds = float(http_request.parameters.get("seconds", 30))
+            sample_rate = float(http_request.parameters.get("sample", 1.0))
+            interval = float(http_request.parameters.get("interval", 0.005))
+        except ValueError:
+            seconds = -1
+        if mode not in tracing.PROFILE_MODES or not 0 < seconds <= 3600 or not 0 < sample_rate <= 1 or interval <= 0:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+        path = self.profiler.start(mode, seconds, sample_rate=sample_rate, interval=interval)
+        if path is None:
+            return HTTPResponse.build(server=self.server, status_code=409, reason="Profiling Already Running")
+        return HTTPResponse.build(server=self.server, status_code=202, reason="Accepted",
+                                  content_type="application/json; charset=utf-8",
+                                  body=(HTTPBodyType.TEXT, json.dumps({"mode": mode, "seconds": seconds, "file": path})))
 
-        utils.init_sql()
+    @staticmethod
+    def _route(http_request: HTTPRequest, response: HTTPResponse) -> str:
+        if http_request is None:
+            return "invalid"
+        method = http_request.get_method()
+        uri = http_request.get_uri().lower()
+        if method == HTTPMethod.ENCRYPT:
+            return "encrypt"
+        if method == HTTPMethod.POST:
+            return uri[1:] if uri in ("/upload", "/register", "/delete") else "other"
+        if uri in ("/", ""):
+            return "login"
+        if uri == "/metrics":
+            return "metrics"
+        if response.status_code == 304:
+            return "not_modified"
+        if response.ranges:
+            return "range"
+        body_type = response.get_body()[0]
+        if body_type == HTTPBodyType.FILE:
+            return "download"
+        if body_type in (HTTPBodyType.TEXT, HTTPBodyType.STREAM) and response.status_code == 200:
+            return "listing"
+        return "other"
+
+    @staticmethod
+    def create_tls_context(cert: str, key: str) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.load_cert_chain(cert, key)
+        context.set_alpn_protocols(["http/1.1"])
+        context.options |= ssl.OP_NO_COMPRESSION
+        # TLS 1.3 resumption tickets, TLS 1.2 clients use the server side session cache
+        context.num_tickets = 2
+        return context
+
+    def accept_tls(self):
+        while True:
+            conn, addr = self.tls_socket.accept()
+            # the handshake runs in the worker, not in the accept loop
+            conn = self.tls_context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False)
+            if self.worker_pool:
+                self.worker_pool.submit(conn, addr)
+            else:
+                new_thread = threading.Thread(
+                    target=self.handle_connection, args=(conn, addr))
+                new_thread.daemon = True
+                new_thread.start()
+
+    def do_handshake(self, conn: socket.socket, addr: tuple) -> bool:
+        try:
+            conn.settimeout(self.timeout)
+            conn.do_handshake()
+            return True
+        except (OSError, ssl.SSLError) as e:
+            self.log.log(
+                LogLevel.INFO, f"TLS handshake with {addr[0]}:{addr[1]} failed: {e}")
+            return False
 
     def run(self):
         self.log.log(
-            LogLevel.INFO, f"{self.server} is running on {self.host}:{self.port}...")
+            LogLevel.INFO, f"{self.server} is running on {self.host}:{self.port} with {self.engine} engine...")
+        if self.tls_socket:
+            self.log.log(
+                LogLevel.INFO, f"TLS is enabled on {self.host}:{self.tls_port}")
+        self.connections.start()
+        if self.admin_socket:
+            self.log.log(
+                LogLevel.INFO, f"Admin endpoints are served on {self.admin_host}:{self.admin_port}")
+            admin_thread = threading.Thread(target=self.accept_admin, name="admin-accept")
+            admin_thread.daemon = True
+            admin_thread.start()
+        if self.engine == "async":
+            AsyncEngine(self, max_workers=self.async_workers).run()
+            return
+        if self.engine == "pool":
+            self.worker_pool = WorkerPool(self.handle_connection, self.reject_connection,
+                                          min_workers=self.pool_min_workers, max_workers=self.pool_max_workers,
+                                          queue_size=self.pool_queue_size, overflow=self.pool_overflow,
+                                          log=self.log, stats_interval=self.pool_stats_interval)
+            self.worker_pool.start()
+        if self.tls_socket:
+            tls_thread = threading.Thread(target=self.accept_tls, name="tls-accept")
+            tls_thread.daemon = True
+            tls_thread.start()
+        if self.worker_pool:
+            while True:
+                conn, addr = self.socket.accept()
+                self.worker_pool.submit(conn, addr)
         while True:
             conn, addr = self.socket.accept()
             new_thread = threading.Thread(
@@ -47,36 +283,83 @@ class HTTPServer:
             new_thread.start()
 
     def handle_request(self, conn: HTTPConnection) -> HTTPResponse:
-        conn.settimeout(self.timeout)
+        conn.settimeout(self.idle_timeout)
+        conn.set_body_length(None)
+        conn.request = None
+        conn.trace = None
+        if not conn.has_buffered_data():
+            self.connections.set_idle(conn)
         try:
-            data = conn.recv(4096)
+            headers_data = conn.read_until(b"\r\n\r\n", self.max_header_size, skip=b"\r\n", timeout=self.header_timeout, deadline=conn.header_deadline)
         except socket.timeout:
             self.log.log(
                 LogLevel.INFO, f"Timeout from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
+            if conn.has_buffered_data():
+                return HTTPResponse.build(server=self.server, status_code=408,
+                                          reason="Request Timeout",
+                                          keep_alive=False), None
             return HTTPResponse.build(server=self.server, status_code=200,
                                       reason="Timeout Closed",
                                       keep_alive=False), None
-        if not data:
+        except HeaderTooLargeError as e:
             self.log.log(
-                LogLevel.INFO, f"Empty Request from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
-            return HTTPResponse.build(server=self.server, status_code=400,
-                                      reason="Bad Request",
-                                      keep_alive=True), None
-        # bug here?
-        index = data.find(b"\r\n\r\n")
-
-        if index == -1:
+                LogLevel.INFO, f"Request Header Too Large from {conn.getpeername()[0]}:{conn.getpeername()[1]}: {e}")
+            return HTTPResponse.build(server=self.server, status_code=431,
+                                      reason="Request Header Fields Too Large",
+                                      keep_alive=False), None
+        finally:
+            self.connections.set_active(conn)
+        conn.settimeout(self.timeout)
+        if headers_data is None:
+            if conn.has_buffered_data():
+                self.log.log(
+                    LogLevel.INFO, f"Incomplete Request from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
+                return HTTPResponse.build(server=self.server, status_code=400,
+                                          reason="Bad Request",
+                                          keep_alive=False), None
+            # the peer closed the connection or it was reaped, there is nobody to answer
+            return None, None
+        if headers_data.count(b"\r\n") > self.max_header_count:
             self.log.log(
-                LogLevel.INFO, f"Bad Request from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
-            return HTTPResponse.build(server=self.server, status_code=400,
-                                      reason="Bad Request",
+                LogLevel.INFO, f"Too Many Request Headers from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
+            return HTTPResponse.build(server=self.server, status_code=431,
+                                      reason="Request Header Fields Too Large",
                                       keep_alive=False), None
-        headers_data = data[:index]
-        body_data = data[index+len(b"\r\n\r\n"):]
 
+        conn.trace = tracing.begin()
+        if self.profiler.running:
+            self.profiler.attach(conn.trace)
         request_headers = headers_data.decode("utf-8")
         http_request = HTTPRequest.build_by_headers(
-            request_headers, body_data, 4096)
+            request_headers, b"", 0)
+        conn.request = http_request
+        transfer_encoding = http_request.get_headers().get("Transfer-Encoding")
+        if transfer_encoding is not None:
+            codings = [coding.strip().lower() for coding in transfer_encoding.split(",")]
+            if codings != ["chunked"]:
+                self.log.log(
+                    LogLevel.INFO, f"Unsupported Transfer-Encoding {transfer_encoding} from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
+                return HTTPResponse.build(server=self.server, status_code=501 if codings[-1] == "chunked" else 400,
+                                          reason="Not Implemented" if codings[-1] == "chunked" else "Bad Request",
+                                          keep_alive=False), None
+            conn.set_chunked_body(self.max_body_size)
+        else:
+            content_length = http_request.get_headers().get("Content-Length", "0").strip()
+            # int() would also take signs, underscores and non-ascii digits
+            if not (content_length.isascii() and content_length.isdigit()):
+                self.log.log(
+                    LogLevel.INFO, f"Invalid Content-Length {content_length[:32]!r} from {conn.getpeername()[0]}:{conn.getpeername()[1]}")
+                return HTTPResponse.build(server=self.server, status_code=400,
+                                          reason="Bad Request",
+                                          keep_alive=False), None
+            content_length = int(content_length)
+            if self.max_body_size and content_length > self.max_body_size:
+                return HTTPResponse.build(server=self.server, status_code=413,
+                                          reason="Content Too Large",
+                                          keep_alive=False), None
+            conn.set_body_length(content_length)
+        http_request.body = conn.recv_buffered()
+        conn.trace.mark("parse")
 
         keep_alive = False
         if "Connection" in http_request.get_headers():
@@ -90,51 +373,185 @@ class HTTPServer:
 
         # print(http_request)
         aes_encryptor = None
-        if http_request.get_method() == HTTPMethod.GET:
-            response = self.handle_request_get(conn, http_request)
-        elif http_request.get_method() == HTTPMethod.POST:
-            response = self.handle_request_post(conn, http_request)
-        elif http_request.get_method() == HTTPMethod.HEAD:
-            response = self.handle_request_get(
-                conn, http_request)
-            response.is_head = True
-        elif http_request.get_method() == HTTPMethod.ENCRYPT:
-            response, aes_encryptor = self.hanlde_request_encrypt(
-                conn, http_request
-            )
-        else:
-            return HTTPResponse.build(server=self.server, status_code=405,
-                                      reason="Method Not Allowed"), None
-        response.headers["Connection"] = "Keep-Alive" if keep_alive and response.status_code < 300 else "Close"
+        try:
+            if http_request.get_method() == HTTPMethod.GET:
+                response = self.handle_request_get(conn, http_request)
+            elif http_request.get_method() == HTTPMethod.POST:
+                response = self.handle_request_post(conn, http_request)
+            elif http_request.get_method() == HTTPMethod.HEAD:
+                response = self.handle_request_get(
+                    conn, http_request)
+                response.is_head = True
+            elif http_request.get_method() == HTTPMethod.ENCRYPT:
+                response, aes_encryptor = self.hanlde_request_encrypt(
+                    conn, http_request
+                )
+            elif http_request.get_method() in (HTTPMethod.PUT, HTTPMethod.DELETE) and http_request.get_uri().startswith("/uploads/"):
+                response = self.handle_upload_session(conn, http_request)
+            else:
+                return HTTPResponse.build(server=self.server, status_code=405,
+                                          reason="Method Not Allowed"), None
+        except BodyTooLargeError as e:
+            self.log.log(
+                LogLevel.INFO, f"Request Body Too Large from {conn.getpeername()[0]}:{conn.getpeername()[1]}: {e}")
+            return HTTPResponse.build(server=self.server, status_code=413,
+                                      reason="Content Too Large",
+                                      keep_alive=False), None
+        except ChunkedEncodingError as e:
+            self.log.log(
+                LogLevel.INFO, f"Invalid Chunked Body from {conn.getpeername()[0]}:{conn.getpeername()[1]}: {e}")
+            return HTTPResponse.build(server=self.server, status_code=400,
+                                      reason="Bad Request",
+                                      keep_alive=False), None
+        conn.trace.mark("handler")
+        if self.compression and response.status_code == 200 and http_request.get_method() in (HTTPMethod.GET, HTTPMethod.HEAD):
+            self.encode_response(http_request, response, create=http_request.get_method() != HTTPMethod.HEAD)
+            conn.trace.mark("compress")
+        try:
+            drained = conn.drain_body(self.max_header_size)
+        except (ChunkedEncodingError, BodyTooLargeError):
+            drained = False
+        if not drained:
+            # the rest of an unread body would be parsed as the next request
+            keep_alive = False
+        if transfer_encoding is not None and "Content-Length" in http_request.get_headers():
+            # conflicting framing, another hop may have read the body differently
+            keep_alive = False
+        conn.requests += 1
+        if conn.requests >= self.max_requests:
+            keep_alive = False
+        keep_alive = keep_alive and (response.status_code < 300 or response.status_code == 304)
+        response.headers["Connection"] = "Keep-Alive" if keep_alive else "Close"
         if keep_alive:
-            response.headers["Keep-Alive"] = f"timeout={self.timeout}; max={self.parallel}"
+            response.headers["Keep-Alive"] = f"timeout={int(self.idle_timeout)}; max={self.max_requests - conn.requests}"
         return response, aes_encryptor
 
+    def not_modified(self, http_request: HTTPRequest, validators: dict, body: tuple, content_type: str, set_cookie: str) -> HTTPResponse:
+        # negotiated like the 200 it stands for, so a cache pairs it with the right variant
+        representation = HTTPResponse.build(server=self.server, body=body, headers=dict(validators), content_type=content_type)
+        if self.compression:
+            self.encode_response(http_request, representation, create=http_request.get_method() != HTTPMethod.HEAD)
+        headers = {name: representation.headers[name] for name in ("ETag", "Last-Modified", "Vary") if name in representation.headers}
+        return HTTPResponse.build(server=self.server, status_code=304, reason="Not Modified",
+                                  headers=headers, set_cookie=set_cookie)
+
+    def encode_response(self, http_request: HTTPRequest, response: HTTPResponse, create: bool=True):
+        body_type = response.get_body()[0]
+        if body_type == HTTPBodyType.EMPTY or response.ranges or not content_encoding.is_compressible(response.get_headers().get("Content-Type")):
+            return
+        response.headers["Vary"] = "Accept-Encoding"
+        encoding = content_encoding.negotiate(http_request.get_headers().get("Accept-Encoding", ""))
+        if encoding is None:
+            return
+        if body_type == HTTPBodyType.TEXT:
+            data = response.get_body()[1]
+            if isinstance(data, str):
+                data = data.encode()
+            if len(data) < self.compression_min_size:
+                return
+            etag = response.headers.get("ETag")
+            compressed = self.compressed_texts.get((etag, encoding)) if etag else None
+            if compressed is None:
+                compressed = content_encoding.compress(data, encoding, self.compression_level)
+                if etag:
+                    self.compressed_texts.set((etag, encoding), compressed)
+            if len(compressed) >= len(data):
+                return
+            response.set_body((HTTPBodyType.TEXT, compressed))
+        elif body_type == HTTPBodyType.STREAM:
+            response.set_body((HTTPBodyType.STREAM, content_encoding.compress_stream(response.get_body()[1], encoding, self.compression_level)))
+        elif body_type == HTTPBodyType.FILE:
+            stat = os.stat(response.get_body()[1])
+            if stat.st_size < self.compression_min_size:
+                return
+            # a HEAD request only reports a compressed version that already exists instead of compressing the file
+            compressed_path = self.compressed_files.get(response.get_body()[1], stat, encoding, create=create)
+            if compressed_path is None:
+                return
+            response.set_body((HTTPBodyType.FILE, compressed_path))
+        response.headers["Content-Encoding"] = encoding
+        if "ETag" in response.headers:
+            response.headers["ETag"] = content_encoding.tag_etag(response.headers["ETag"], encoding)
+
     def handle_connection(self, conn: socket.socket, addr: tuple):
         self.log.log(
             LogLevel.INFO, f"Receive new connection from {addr[0]}:{addr[1]}")
 
+        if isinstance(conn, ssl.SSLSocket) and not self.do_handshake(conn, addr):
+            self.close_connection(conn, addr)
+            return
+
         conn = HTTPConnection(conn)
+        self.connections.register(conn, addr)
 
-        while True:
-            try:
-                response, aes_encryptor = self.handle_request(conn)
-                self.log.log(
-                    LogLevel.INFO, f"Response to {addr[0]}:{addr[1]}: {response.get_status_code()} {response.get_reason()}")
-                response.send(conn)
-                if not response.get_headers()["Connection"].lower() == "keep-alive":
-                    break
-                if aes_encryptor:
-                    conn.set_encryptor(aes_encryptor)
-            except Exception as e:
-                if self.debug:
-                    import traceback
-                    traceback.print_exc()
-                self.log.log(LogLevel.ERROR, f"Error: {e}")
-                break
+        while self.serve_request(conn, addr):
+            pass
+        self.close_connection(conn, addr)
+
+    def reject_connection(self, conn: socket.socket, addr: tuple):
+        self.log.log(
+            LogLevel.WARNING, f"Reject connection from {addr[0]}:{addr[1]}, worker pool is full")
         try:
-            time.sleep(1)
-            conn.close()
+            conn.settimeout(1)
+            HTTPResponse.build(server=self.server, status_code=503, reason="Service Unavailable",
+                               headers={"Retry-After": str(self.retry_after)}).send(conn)
+        except Exception as e:
+            pass
+        conn.close()
+
+    def serve_request(self, conn: HTTPConnection, addr: tuple) -> bool:
+        bytes_sent, bytes_received = conn.bytes_sent, conn.bytes_received
+        try:
+            response, aes_encryptor = self.handle_request(conn)
+            if response is None:
+                return False
+            self.log.log(
+                LogLevel.INFO, f"Response to {addr[0]}:{addr[1]}: {response.get_status_code()} {response.get_reason()}")
+            response.send(conn)
+            if conn.trace:
+                conn.trace.mark("send")
+            self.observe_request(conn, response)
+            if not response.get_headers()["Connection"].lower() == "keep-alive":
+                return False
+            if aes_encryptor:
+                conn.set_encryptor(aes_encryptor)
+            return True
+        except Exception as e:
+            if self.debug:
+                import traceback
+                traceback.print_exc()
+            self.log.log(LogLevel.ERROR, f"Error: {e}")
+            return False
+        finally:
+            metrics.HTTP_SENT_BYTES.inc(conn.bytes_sent - bytes_sent)
+            metrics.HTTP_RECEIVED_BYTES.inc(conn.bytes_received - bytes_received)
+            if conn.trace:
+                self.profiler.detach(conn.trace)
+                tracing.end()
+
+    def observe_request(self, conn: HTTPConnection, response: HTTPResponse):
+        # an idle keep-alive connection that timed out did not send a request
+        if conn.request is None and response.status_code < 400:
+            return
+        method = conn.request.get_method().value if conn.request else "INVALID"
+        route = self._route(conn.request, response)
+        metrics.HTTP_REQUESTS.labels(method, route, str(response.status_code)).inc()
+        if conn.trace is None:
+            return
+        elapsed = conn.trace.elapsed()
+        metrics.HTTP_REQUEST_DURATION.labels(method, route).observe(elapsed)
+        for phase, duration in conn.trace.phases.items():
+            metrics.HTTP_REQUEST_PHASE_DURATION.labels(phase).observe(duration)
+        if self.slow_request_threshold and elapsed >= self.slow_request_threshold:
+            self.log.log(
+                LogLevel.WARNING, f"Slow request {method} {conn.request.get_uri()} {response.get_status_code()} took {elapsed * 1000:.1f}ms: {conn.trace.format()}")
+
+    def close_connection(self, conn: HTTPConnection, addr: tuple):
+        try:
+            if isinstance(conn, HTTPConnection):
+                self.connections.close(conn)
+            else:
+                conn.close()
         except Exception as e:
             pass
         self.log.log(
@@ -151,10 +568,10 @@ class HTTPServer:
                         cookie_uuid = ud.UUID(cookie_dict["session-id"])
                     except Exception as e:
                         return (None, None, True)
-                    user_uuid = utils.get_user_by_cookie(cookie_uuid)
-                    if user_uuid is None:
+                    session = self.sessions.get(cookie_uuid)
+                    if session is None:
                         return None, str(cookie_uuid), True
-                    user = utils.get_user_name_by_uuid(user_uuid)
+                    user = session[1]
                     return (user, str(cookie_uuid), True)
         else:
             auth = headers["Authorization"]
@@ -183,7 +600,7 @@ class HTTPServer:
 
         if user is None:
             return (401, "Authorization Required" if not is_cookie else "Cookie invalid or expired", None)
-        uuid = utils.get_user_by_name(user)
+        uuid = self.sessions.get_user_by_name(user)
         if uuid is None:
             return (401, "User not exists", None)
         if check_permission and root_user != user:
@@ -198,26 +615,70 @@ class HTTPServer:
             if cookie_uuid is None:
                 cookie_uuid = utils.generate_cookie(
                     uuid, self.cookie_persist_time)
-        utils.resign_cookie(cookie_uuid, self.cookie_persist_time)
+        self.sessions.renew(cookie_uuid, self.cookie_persist_time)
         return (200, "", cookie_uuid)
 
+    def _not_modified(self, headers: dict, etag: str, last_modified: float) -> bool:
+        if "If-None-Match" in headers:
+            # a validator of a compressed representation still identifies the same content
+            return utils.etag_matches(content_encoding.untag_etags(headers["If-None-Match"]), etag)
+        if "If-Modified-Since" in headers:
+            since = utils.parse_http_date(headers["If-Modified-Since"])
+            return since is not None and int(last_modified) <= since
+        return False
+
+    def _if_range_matches(self, headers: dict, etag: str, last_modified: float) -> bool:
+        if "If-Range" not in headers:
+            return True
+        if_range = headers["If-Range"].strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return utils.etag_matches(if_range, etag, weak=False)
+        since = utils.parse_http_date(if_range)
+        return since is not None and int(last_modified) == since
+
     def hanlde_request_encrypt(self, conn: HTTPConnection, http_request: HTTPRequest) -> HTTPResponse:
         body = http_request.get_body()
-        if "Content-Length" in http_request.get_headers():
-            content_length = int(http_request.get_headers()["Content-Length"])
-            if content_length > 0:
-                _len = len(body)
-                while _len < content_length:
-                    _len += min(self.upload_chunk_size, content_length - _len)
-                    body += conn.recv(min(self.upload_chunk_size, content_length -
-                                      _len))
-        aes_encryptor = AESEncryptor()
+        while True:
+            # the connection stops at the end of the body, whether it has a length or is chunked
+            data = conn.recv(self.upload_chunk_size)
+            if not data:
+                break
+            body += data
+        mode = http_request.get_headers().get("Encrypt-Mode", "cfb").strip().lower()
+        if mode not in ENCRYPT_MODES:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Unsupported Encrypt Mode"), None
+        if "Encrypt-Session" in http_request.get_headers():
+            response, aes_encryptor = self._resume_encrypt_session(http_request, mode)
+            # a client that also sent its public key falls back to the full handshake
+            if aes_encryptor or not body:
+                return response, aes_encryptor
+        aes_encryptor = create_encryptor(mode)
         data = RSAEncryptor.encrypt(
             aes_encryptor.get_key() + aes_encryptor.get_iv(), body)
-        return HTTPResponse.build(server=self.server, status_code=200, reason="OK", body=(HTTPBodyType.TEXT, data), content_type="encryption/aes-key"), aes_encryptor
+        return HTTPResponse.build(server=self.server, status_code=200, reason="OK", body=(HTTPBodyType.TEXT, data), content_type="encryption/aes-key",
+                                  headers={"Encrypt-Mode": mode,
+                                           "Encrypt-Session": self.encrypt_tickets.issue(aes_encryptor.get_key())}), aes_encryptor
+
+    def _resume_encrypt_session(self, http_request: HTTPRequest, mode: str) -> (HTTPResponse, AESEncryptor):
+        master_key = self.encrypt_tickets.open(http_request.get_headers()["Encrypt-Session"])
+        try:
+            client_nonce = bytes.fromhex(http_request.get_headers().get("Encrypt-Nonce", ""))
+        except ValueError:
+            client_nonce = b""
+        if len(client_nonce) != NONCE_SIZE:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request"), None
+        if master_key is None:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Invalid Encrypt Session"), None
+        server_nonce = os.urandom(NONCE_SIZE)
+        key, iv = derive_key(master_key, client_nonce, server_nonce)
+        return HTTPResponse.build(server=self.server, status_code=200, reason="OK",
+                                  headers={"Encrypt-Mode": mode, "Encrypt-Nonce": server_nonce.hex()}), create_encryptor(mode, key, iv)
 
     def handle_request_post(self, conn: HTTPConnection, http_request: HTTPRequest) -> HTTPResponse:
         uri = http_request.get_uri()
+
+        if uri == "/uploads" or uri.startswith("/uploads/"):
+            return self.handle_upload_session(conn, http_request)
         
         if uri.lower() == "/register":
             if "user" not in http_request.parameters or "password" not in http_request.parameters:
@@ -226,10 +687,14 @@ class HTTPServer:
             password = http_request.parameters["password"]
             if user is None or password is None or user == "" or password == "":
                 return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+            if user.lower() in RESERVED_NAMES:
+                return HTTPResponse.build(server=self.server, status_code=400, reason="Reserved User Name")
             try:
                 uuid = utils.create_user(user, password)
             except Exception as e:
                 return HTTPResponse.build(server=self.server, status_code=400, reason="User already exists")
+            finally:
+                tracing.mark("auth")
             return HTTPResponse.build(server=self.server, status_code=200, reason="OK")
         
         if "path" not in http_request.parameters:
@@ -241,10 +706,12 @@ class HTTPServer:
             http_request.get_headers())
         auth_code, msg, uuid = self._verify_auth(
             root_user, user, password, is_cookie)
+        tracing.mark("auth")
         if auth_code != 200:
             return HTTPResponse.build(server=self.server, status_code=auth_code,
                                       reason="Unauthorized" if auth_code != 403 else msg,
                                       headers={"WWW-Authenticate": f"Basic realm=\"{msg}\""} if auth_code != 403 else None)
+        self.bandwidth.bind(conn, user)
 
         if not os.path.exists(abs_file_path):
             return HTTPResponse.build(server=self.server, status_code=404, reason="Not Found")
@@ -297,74 +764,55 @@ class HTTPServer:
                     return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
                 content_type_headers = dict(_header.split(
                     "=") for _header in headers["Content-Type"].split("; ")[1:])
-                boundary = content_type_headers["boundary"]
+                boundary = content_type_headers["boundary"].strip("\"")
                 boundary = boundary.encode()
+                upload_files = []
+
+                def open_part(part_headers: dict):
+                    filename = MultipartParser.get_filename(part_headers)
+                    if not filename:
+                        filename = str(ud.uuid4()) + ".tmp"
+                    filename = os.path.basename(filename)
+                    upload_file_path = os.path.join(abs_file_path, filename)
+                    while os.path.exists(upload_file_path):
+                        index = filename.rfind(".")
+                        if index == -1:
+                            index = len(filename)
+                        filename = filename[:index] + " (1)" + filename[index:]
+                        upload_file_path = os.path.join(abs_file_path, filename)
+                    upload_files.append(upload_file_path)
+                    return open(upload_file_path, "wb")
+
+                parser = MultipartParser(boundary, open_part)
                 body = http_request.get_body()
-                if boundary not in body:
-                    data = conn.recv(self.upload_chunk_size)
-                    body += data if data else b""
-                    if boundary not in body:
-                        return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
-                index = body.find(boundary)
-                body = body[index:]
-                while True:
-                    with tempfile.TemporaryFile(mode="w+b") as tmp:
-                        while True:
-                            tmp.write(body)
-                            if boundary + b"--" in body:
-                                tmp.flush()
-                                tmp.seek(0)
-                                current_file = None
-                                next_line = tmp.readline()
-                                while True:
-                                    line = next_line
-                                    if not line:
-                                        return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
-                                    if line.startswith(b"--" + boundary + b"--"):
-                                        if current_file:
-                                            current_file.close()
-                                            current_file = None
-                                        break
-                                    if line.startswith(boundary) or line.startswith(b"--" + boundary):
-                                        if current_file:
-                                            current_file.close()
-                                            current_file = None
-                                        filename = str(ud.uuid4()) + ".tmp"
-                                        while True:
-                                            line = tmp.readline()
-                                            if line.startswith(b"Content-Disposition"):
-                                                content_disposition = line.decode(
-                                                    "utf-8").strip()
-                                                if "filename" in content_disposition:
-                                                    _headers = dict([header.split("=")
-                                                                    for header in content_disposition.split("; ")[1:]])
-                                                    if "filename" in _headers:
-                                                        filename = _headers["filename"]
-                                                        filename = filename[1:-1]
-                                            if line == b"\r\n":
-                                                break
-                                        filename = os.path.basename(filename)
-                                        upload_file_path = os.path.join(
-                                            abs_file_path, filename)
-                                        while os.path.exists(upload_file_path):
-                                            index = filename.rfind(".")
-                                            filename = filename[:index] + \
-                                                " (1)" + filename[index:]
-                                            upload_file_path = os.path.join(
-                                                abs_file_path, filename)
-                                        current_file = open(
-                                            upload_file_path, "wb")
-                                        next_line = tmp.readline()
-                                        continue
-                                    next_line = tmp.readline()
-                                    if next_line and (next_line.startswith(boundary) or next_line.startswith(b"--" + boundary)):
-                                        line = line[:-len(b'\r\n')]
-                                    current_file.write(line)
-                                return HTTPResponse.build(server=self.server, status_code=200, reason="OK", set_cookie=f"session-id={str(uuid)}; Max-Age={self.cookie_persist_time}")
-                            body = conn.recv(self.upload_chunk_size)
-                            if not body:
-                                return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
-                return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+                upload_start = time.perf_counter()
+                try:
+                    while True:
+                        parser.feed(body)
+                        if parser.is_done():
+                            break
+                        body = conn.recv(conn.throttle.quantum() if conn.throttle else self.upload_chunk_size)
+                        if not body:
+                            break
+                        if conn.throttle:
+                            # not reading lets the receive window fill up and slows the client down
+                            conn.throttle.wait(len(body), "receive")
+                except MultipartError:
+                    pass
+                finally:
+                    incomplete = parser.current_file is not None
+                    parser.close()
+                    tracing.mark("upload")
+                    # also when the body itself was broken or too large
+                    if incomplete:
+                        os.remove(upload_files[-1])
+                if not parser.is_done():
+                    return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+                upload_time = time.perf_counter() - upload_start
+                metrics.UPLOAD_BYTES.inc(parser.bytes_written)
+                if upload_time > 0:
+                    metrics.UPLOAD_THROUGHPUT.observe(parser.bytes_written / upload_time)
+                return HTTPResponse.build(server=self.server, status_code=200, reason="OK", set_cookie=f"session-id={str(uuid)}; Max-Age={self.cookie_persist_time}")
             return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
         elif uri.lower() == "/delete":
             if os.path.isdir(abs_file_path):
@@ -374,6 +822,121 @@ class HTTPServer:
         else:
             return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
 
+    def handle_upload_session(self, conn: HTTPConnection, http_request: HTTPRequest) -> HTTPResponse:
+        method = http_request.get_method()
+        uri = http_request.get_uri()
+        session_id = uri[len("/uploads/"):] if uri.startswith("/uploads/") else None
+        root_user = None
+        if session_id is None:
+            if method != HTTPMethod.POST:
+                return HTTPResponse.build(server=self.server, status_code=405, reason="Method Not Allowed")
+            if "path" not in http_request.parameters:
+                return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+            file_path, root_user, abs_file_path = self._normalize_uri_path(http_request.parameters["path"])
+        user, password, is_cookie = self._get_request_auth(
+            http_request.get_headers())
+        # sessions are checked against their owner, a new one against the target directory
+        auth_code, msg, uuid = self._verify_auth(
+            root_user, user, password, is_cookie, check_permission=session_id is None)
+        tracing.mark("auth")
+        if auth_code != 200:
+            return HTTPResponse.build(server=self.server, status_code=auth_code,
+                                      reason="Unauthorized" if auth_code != 403 else msg,
+                                      headers={"WWW-Authenticate": f"Basic realm=\"{msg}\""} if auth_code != 403 else None)
+        self.bandwidth.bind(conn, user)
+        set_cookie = f"session-id={str(uuid)}; Max-Age={self.cookie_persist_time}"
+        try:
+            if session_id is None:
+                return self._create_upload_session(http_request, user, file_path, abs_file_path, set_cookie)
+            meta = self.upload_sessions.get(session_id, user)
+            if method == HTTPMethod.PUT:
+                return self._write_upload_chunk(conn, http_request, meta, set_cookie)
+            if method in (HTTPMethod.GET, HTTPMethod.HEAD):
+                ranges = self.upload_sessions.ranges(session_id)
+                status = {"id": session_id, "name": meta["name"], "length": meta["length"], "ranges": ranges,
+                          "expires": int(self.upload_sessions.expires(session_id))}
+                return HTTPResponse.build(server=self.server, status_code=200, reason="OK",
+                                          content_type="application/json; charset=utf-8", body=(HTTPBodyType.TEXT, json.dumps(status)),
+                                          headers={"Upload-Length": str(meta["length"]), "Upload-Ranges": format_ranges(ranges),
+                                                   "Cache-Control": "no-store"},
+                                          set_cookie=set_cookie)
+            if method == HTTPMethod.POST:
+                return self._commit_upload_session(meta, set_cookie)
+            if method == HTTPMethod.DELETE:
+                self.upload_sessions.abort(session_id)
+                return HTTPResponse.build(server=self.server, status_code=200, reason="OK", set_cookie=set_cookie)
+            return HTTPResponse.build(server=self.server, status_code=405, reason="Method Not Allowed")
+        except UploadSessionError as e:
+            return HTTPResponse.build(server=self.server, status_code=e.status_code, reason=e.reason)
+
+    def _create_upload_session(self, http_request: HTTPRequest, user: str, file_path: str, abs_file_path: str, set_cookie: str) -> HTTPResponse:
+        headers = http_request.get_headers()
+        if not os.path.isdir(abs_file_path):
+            return HTTPResponse.build(server=self.server, status_code=404, reason="Not Found")
+        try:
+            length = int(headers["Upload-Length"])
+        except (KeyError, ValueError):
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+        name = utils.unquote_uri(headers.get("Upload-Name", ""))
+        name = name.replace("\\", "/").rstrip("/").split("/")[-1]
+        if name in ("", ".", ".."):
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Invalid File Name")
+        session_id = self.upload_sessions.create(user, file_path, name, length)
+        return HTTPResponse.build(server=self.server, status_code=201, reason="Created",
+                                  headers={"Location": f"/uploads/{session_id}",
+                                           "Upload-Expires": utils.http_date(self.upload_sessions.expires(session_id))},
+                                  set_cookie=set_cookie)
+
+    def _write_upload_chunk(self, conn: HTTPConnection, http_request: HTTPRequest, meta: dict, set_cookie: str) -> HTTPResponse:
+        headers = http_request.get_headers()
+        span = parse_content_range(headers.get("Content-Range", ""), meta["length"])
+        if span is None:
+            return HTTPResponse.build(server=self.server, status_code=416, reason="Range Not Satisfiable",
+                                      headers={"Content-Range": f"bytes */{meta['length']}"})
+        start, end = span
+        if not conn.chunked and int(headers.get("Content-Length", 0)) != end - start + 1:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request")
+
+        def body():
+            remaining = end - start + 1
+            data = http_request.get_body()
+            while True:
+                if data:
+                    # a chunked body is only known to fit the range while it arrives
+                    if len(data) > remaining:
+                        raise UploadSessionError(400, "Chunk Exceeds Content-Range")
+                    remaining -= len(data)
+                    yield data
+                data = conn.recv(conn.throttle.quantum() if conn.throttle else self.upload_chunk_size)
+                if not data:
+                    return
+                if conn.throttle:
+                    conn.throttle.wait(len(data), "receive")
+
+        written = self.upload_sessions.write(meta["id"], start, body())
+        tracing.mark("upload")
+        metrics.UPLOAD_BYTES.inc(written)
+        upload_headers = {"Upload-Length": str(meta["length"]), "Upload-Ranges": format_ranges(self.upload_sessions.ranges(meta["id"]))}
+        if written != end - start + 1:
+            return HTTPResponse.build(server=self.server, status_code=400, reason="Incomplete Chunk", headers=upload_headers)
+        return HTTPResponse.build(server=self.server, status_code=200, reason="OK", headers=upload_headers, set_cookie=set_cookie)
+
+    def _commit_upload_session(self, meta: dict, set_cookie: str) -> HTTPResponse:
+        abs_dir = os.path.join(utils.get_data_dir(), meta["dir"])
+        if not os.path.isdir(abs_dir):
+            return HTTPResponse.build(server=self.server, status_code=404, reason="Not Found")
+        filename = meta["name"]
+        while os.path.exists(os.path.join(abs_dir, filename)):
+            index = filename.rfind(".")
+            if index == -1:
+                index = len(filename)
+            filename = filename[:index] + " (1)" + filename[index:]
+        self.upload_sessions.commit(meta, os.path.join(abs_dir, filename))
+        return HTTPResponse.build(server=self.server, status_code=200, reason="OK",
+                                  content_type="application/json; charset=utf-8",
+                                  body=(HTTPBodyType.TEXT, json.dumps({"path": meta["dir"].replace(os.path.sep, "/") + "/" + filename})),
+                                  set_cookie=set_cookie)
+
     def handle_request_get(self, conn: HTTPConnection, http_request: HTTPRequest) -> HTTPResponse:
         
         sustech_http = False
@@ -382,16 +945,13 @@ class HTTPServer:
                 if http_request.parameters["SUSTech-HTTP"] == "1":
                     sustech_http = True
 
-        if "Content-Length" in http_request.get_headers():
-            content_length = int(http_request.get_headers()["Content-Length"])
-            if content_length > 0:
-                body = http_request.get_body()
-                _len = len(body)
-                while _len < content_length:
-                    _len += min(self.upload_chunk_size, content_length - _len)
-                    conn.recv(min(self.upload_chunk_size, content_length -
-                                  _len))
+        while conn.recv(self.upload_chunk_size):
+            pass
         uri = http_request.get_uri()
+        if uri == "/metrics" and self.expose_metrics:
+            return self.handle_metrics(http_request)
+        if uri.startswith("/uploads/"):
+            return self.handle_upload_session(conn, http_request)
         if uri == "/" or uri == "":
             user, password, is_cookie = self._get_request_auth(
                 http_request.get_headers())
@@ -405,6 +965,7 @@ class HTTPServer:
                                           body=(HTTPBodyType.TEXT, utils.login_html()))
             auth_code, msg, cookie_uuid = self._verify_auth(
                 user, user, password, is_cookie)
+            tracing.mark("auth")
             if auth_code != 200:
                 if is_cookie:
                     return HTTPResponse.build(server=self.server, status_code=200,
@@ -436,19 +997,54 @@ class HTTPServer:
 
             auth_code, msg, cookie_uuid = self._verify_auth(
                 root_user, user, password, is_cookie, check_permission=False)
+            tracing.mark("auth")
 
             if auth_code != 200:
                 return HTTPResponse.build(server=self.server, status_code=auth_code,
                                           reason="Unauthorized" if auth_code != 403 else msg,
                                           headers={"WWW-Authenticate": f"Basic realm=\"{msg}\""} if auth_code != 403 else None)
+            self.bandwidth.bind(conn, user)
 
             if not os.path.exists(abs_file_path):
                 return HTTPResponse.build(server=self.server, status_code=404, reason="Not Found")
 
             if os.path.isdir(abs_file_path):
-                html = utils.file_explore_html(
-                    file_path, root_user, abs_file_path, sustech_http=sustech_http)
+                if http_request.parameters.get("format") == "json":
+                    try:
+                        listing = utils.list_directory(file_path, abs_file_path,
+                                                       sort=http_request.parameters.get("sort", "type"),
+                                                       order=http_request.parameters.get("order", "asc"),
+                                                       limit=min(int(http_request.parameters.get("limit", self.listing_page_size)), self.listing_max_page_size),
+                                                       cursor=http_request.parameters.get("cursor"))
+                    except ValueError as e:
+                        return HTTPResponse.build(server=self.server, status_code=400, reason="Bad Request",
+                                                  content_type="text/plain; charset=utf-8", body=(HTTPBodyType.TEXT, str(e)))
+                    tracing.mark("filesystem")
+                    listing = json.dumps(listing)
+                    tracing.mark("render")
+                    return HTTPResponse.build(server=self.server, body=(HTTPBodyType.TEXT, listing),
+                                              status_code=200,
+                                              reason="OK",
+                                              content_type="application/json; charset=utf-8",
+                                              set_cookie=f"session-id={str(cookie_uuid)}; Max-Age={self.cookie_persist_time}")
+                if http_request.parameters.get("stream") == "1" and not sustech_http:
+                    return HTTPResponse.build(server=self.server, body=(HTTPBodyType.STREAM, utils.file_explore_html_stream(file_path, root_user, abs_file_path)),
+                                              status_code=200,
+                                              reason="OK",
+                                              content_type="text/html; charset=utf-8",
+                                              set_cookie=f"session-id={str(cookie_uuid)}; Max-Age={self.cookie_persist_time}")
+                # a 304 must not be based on a cached listing that missed a change of its files
+                conditional = "If-None-Match" in http_request.get_headers() or "If-Modified-Since" in http_request.get_headers()
+                html, etag, last_modified = utils.file_explore_entity(
+                    file_path, root_user, abs_file_path, sustech_http=sustech_http, revalidate=conditional)
+                tracing.mark("filesystem")
+                validators = {"ETag": etag, "Last-Modified": utils.http_date(last_modified)}
+                if self._not_modified(http_request.get_headers(), etag, last_modified):
+                    return self.not_modified(http_request, validators, (HTTPBodyType.TEXT, html),
+                                             ("text/html" if not sustech_http else "text/plain") + "; charset=utf-8",
+                                             f"session-id={str(cookie_uuid)}; Max-Age={self.cookie_persist_time}")
                 return HTTPResponse.build(server=self.server, body=(HTTPBodyType.TEXT, html),
+                                          headers=validators,
                                           status_code=200,
                                           reason="OK",
                                           content_type=(
@@ -458,14 +1054,23 @@ class HTTPServer:
                 file_type = mimetypes.guess_type(abs_file_path)[0]
                 if file_type is None:
                     file_type = "application/octet-stream"
-                if "Range" in http_request.get_headers():
+                stat = os.stat(abs_file_path)
+                tracing.mark("filesystem")
+                etag = utils.file_etag(stat)
+                validators = {"ETag": etag, "Last-Modified": utils.http_date(stat.st_mtime)}
+                if self._not_modified(http_request.get_headers(), etag, stat.st_mtime):
+                    return self.not_modified(http_request, validators, (HTTPBodyType.FILE, abs_file_path), file_type,
+                                             f"session-id={str(cookie_uuid)}; Max-Age={self.cookie_persist_time}")
+                if "Range" in http_request.get_headers() and self._if_range_matches(http_request.get_headers(), etag, stat.st_mtime):
                     ranges = http_request.get_headers()["Range"]
                     ranges = utils.parse_ranges(
-                        ranges, os.path.getsize(abs_file_path))
+                        ranges, stat.st_size)
                     if ranges is None:
                         return HTTPResponse.build(server=self.server, status_code=416,
-                                                  reason="Range Not Satisfiable")
+                                                  reason="Range Not Satisfiable",
+                                                  headers={"Content-Range": f"bytes */{stat.st_size}"})
                     return HTTPResponse.build(server=self.server, body=(HTTPBodyType.FILE, abs_file_path),
+                                              headers=dict(validators),
                                               status_code=206,
                                               reason="Partial Content",
                                               content_type=file_type,
@@ -476,6 +1081,7 @@ class HTTPServer:
                     if http_request.parameters["chunked"] == "1":
                         chunked = True
                 return HTTPResponse.build(server=self.server, body=(HTTPBodyType.FILE, abs_file_path),
+                                          headers=dict(validators),
                                           status_code=200,
                                           reason="OK",
                                           content_type=file_type,
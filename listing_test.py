@@ -0,0 +1,37 @@
+import base64
+import json
+import unittest
+import utils
+
+
+def cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+class ListingCursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for sort, key in (("name", ("a",)), ("type", (0, "a")), ("size", (10, "a"))):
+            with self.subTest(sort=sort):
+                encoded = utils.encode_listing_cursor(sort, "asc", key)
+                self.assertEqual(utils.decode_listing_cursor(encoded, sort, "asc"), key)
+
+    def test_mismatched_sort(self):
+        with self.assertRaises(ValueError):
+            utils.decode_listing_cursor(utils.encode_listing_cursor("name", "asc", ("a",)), "size", "asc")
+
+    def test_element_types_are_checked(self):
+        for key in ([{}], [1], [0, "a", 1], ["a", 0], [True, "a"], [0, None], "ab", None):
+            with self.subTest(key=key):
+                with self.assertRaises(ValueError):
+                    utils.decode_listing_cursor(cursor(["type", "asc", key]), "type", "asc")
+
+    def test_not_a_cursor(self):
+        for value in ("!!", cursor("x"), cursor(["type", "asc"])):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    utils.decode_listing_cursor(value, "type", "asc")
+
+
+if __name__ == "__main__":
+    unittest.main()
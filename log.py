@@ -1,6 +1,17 @@
 from datetime import datetime
+from contextlib import contextmanager
+import atexit
 import os
 import enum
+import queue
+import sys
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # no worker processes share the file without fork
+    fcntl = None
 
 class LogLevel(enum.Enum):
     DEBUG = 0
@@ -10,27 +21,153 @@ class LogLevel(enum.Enum):
     FATAL = 4
 
 class Log:
-    def __init__(self, log_file : str, print_to_os : bool=True):
+    def __init__(self, log_file : str, print_to_os : bool=True, level : LogLevel=LogLevel.DEBUG, flush_interval : float=1.0, flush_size : int=256, max_bytes : int=0, rotate_interval : float=0, backup_count : int=5):
         self.log_file = log_file
         self.print_to_os = print_to_os
+        self.level = level
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
         if not self.log_file.endswith('.log'):
             self.log_file += '.log'
-        
+
         if not os.path.exists(self.log_file):
             dir = os.path.dirname(self.log_file)
-            if not os.path.exists(dir):
+            if dir and not os.path.exists(dir):
                 os.makedirs(dir)
             with open(self.log_file, 'w') as f:
                 f.write('')
 
+        self.time_cache = (None, None)
+        self.writer_pid = None
+        self._start_writer()
+        atexit.register(self.close)
+        # the writer thread does not survive a fork into a worker process
+        os.register_at_fork(after_in_child=self._start_writer)
+
     def format_message(self, type : LogLevel, message : str):
-        current_time = datetime.now().strftime("%H:%M:%S")
+        second = int(time.time())
+        cached_second, current_time = self.time_cache
+        if second != cached_second:
+            current_time = datetime.fromtimestamp(second).strftime("%H:%M:%S")
+            self.time_cache = (second, current_time)
         formatted_message = f"[{ type.name }][{current_time}] {message}"
         return formatted_message
 
     def log(self, type : LogLevel, message : str):
-        formatted_message = self.format_message(type, message)
-        if self.print_to_os:
-            print(formatted_message)
-        with open(self.log_file, 'a') as f:
-            f.write(formatted_message + '\n')
+        if type.value < self.level.value:
+            return
+        self.queue.put(self.format_message(type, message))
+
+    def close(self):
+        if self.writer_pid != os.getpid():
+            return
+        self.queue.put(None)
+        self.writer.join()
+
+    def _start_writer(self):
+        self.queue = queue.SimpleQueue()
+        self.writer_pid = os.getpid()
+        self.writer = threading.Thread(target=self._write_loop, name="log-writer")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _write_loop(self):
+        file = None
+        opened_time = time.monotonic()
+        closing = False
+        while not closing:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                try:
+                    message = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if message is None:
+                    closing = True
+                    break
+                batch.append(message)
+            if not batch:
+                continue
+            text = '\n'.join(batch) + '\n'
+            if self.print_to_os:
+                print(text, end='', flush=True)
+            try:
+                if file is None:
+                    file = open(self.log_file, 'a')
+                    opened_time = time.monotonic()
+                file.write(text)
+                file.flush()
+                if self._rotated_elsewhere(file):
+                    # another worker process or an external tool rotated the file
+                    file.close()
+                    file = open(self.log_file, 'a')
+                    opened_time = time.monotonic()
+                elif self._should_rotate(file, opened_time):
+                    file = self._rotate_file(file)
+                    opened_time = time.monotonic()
+            except Exception as e:
+                # the writer has to survive, the file is opened again with the next batch
+                print(f"[ERROR] Writing log file {self.log_file} failed: {e}", file=sys.stderr, flush=True)
+                if file is not None:
+                    try:
+                        file.close()
+                    except Exception:
+                        pass
+                    file = None
+        if file is not None:
+            file.close()
+
+    def _rotated_elsewhere(self, file) -> bool:
+        try:
+            return os.stat(self.log_file).st_ino != os.fstat(file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _should_rotate(self, file, opened_time : float) -> bool:
+        if self.max_bytes > 0 and file.tell() >= self.max_bytes:
+            return True
+        if self.rotate_interval > 0 and time.monotonic() - opened_time >= self.rotate_interval:
+            return True
+        return False
+
+    @contextmanager
+    def _rotation_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.log_file}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _rotate_file(self, file):
+        inode = os.fstat(file.fileno()).st_ino
+        file.close()
+        with self._rotation_lock():
+            try:
+                # the workers share the file, only the first one due rotates it, the others reopen
+                if os.stat(self.log_file).st_ino == inode:
+                    self._rotate()
+            except FileNotFoundError:
+                pass
+        return open(self.log_file, 'a')
+
+    def _rotate(self):
+        try:
+            if self.backup_count <= 0:
+                os.remove(self.log_file)
+                return
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.log_file}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.log_file}.{i + 1}")
+            os.replace(self.log_file, f"{self.log_file}.1")
+        except FileNotFoundError:
+            # already rotated by someone else
+            pass
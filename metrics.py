@@ -0,0 +1,201 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable
+
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+THROUGHPUT_BUCKETS = tuple(1024 * 1024 * mb for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+def format_value(value : float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def format_labels(names : tuple, values : tuple, *extra : str) -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    pairs.extend(label for label in extra if label)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape_label(value : str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class CounterChild:
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount : float=1.0):
+        with self.lock:
+            self.value += amount
+
+
+class HistogramChild:
+
+    def __init__(self, buckets : tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value : float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+
+    type = None
+
+    def __init__(self, name : str, help : str, labels : tuple=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = dict()
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self.children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        # the lock is only taken the first time a label combination is seen
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def render(self, const : str=None) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self.children.items()):
+            lines.extend(self._render_child(values, child, const))
+        return lines
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount : float=1.0):
+        self.children[()].inc(amount)
+
+    def _render_child(self, values : tuple, child : CounterChild, const : str=None) -> list:
+        return [f"{self.name}{format_labels(self.label_names, values, const)} {format_value(child.value)}"]
+
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, name : str, help : str, labels : tuple=(), buckets : tuple=DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value : float):
+        self.children[()].observe(value)
+
+    def _render_child(self, values : tuple, child : HistogramChild, const : str=None) -> list:
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            bucket_label = 'le="' + format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, values, const, bucket_label)} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.label_names, values, const)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(self.label_names, values, const)} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+
+    type = "gauge"
+
+    def __init__(self, name : str, help : str, collect : Callable[[], dict], labels : tuple=()):
+        # collect returns {label values: value}, it is called on every scrape
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label_names = tuple(labels)
+
+    def render(self, const : str=None) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, values, const)} {format_value(value)}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = dict()
+        self.const_labels = None
+        self.lock = threading.Lock()
+
+    def set_const_label(self, name : str, value : str):
+        # added to every series, e.g. the worker process that collected it
+        self.const_labels = format_labels((name,), (value,))[1:-1]
+
+    def register(self, metric):
+        with self.lock:
+            # re-registering a callback replaces it, e.g. for a new worker pool
+            if metric.name in self.metrics and not isinstance(metric, GaugeCallback):
+                return self.metrics[metric.name]
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name : str, help : str, labels : tuple=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name : str, help : str, labels : tuple=(), buckets : tuple=DURATION_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge_callback(self, name : str, help : str, collect : Callable[[], dict], labels : tuple=()) -> GaugeCallback:
+        return self.register(GaugeCallback(name, help, collect, labels))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render(self.const_labels))
+            except Exception:
+                # a failing callback must not break the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+START_TIME = time.time()
+REGISTRY.gauge_callback("process_start_time_seconds", "Start time of the process since unix epoch in seconds",
+                        lambda: {(): START_TIME})
+
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "Handled HTTP requests", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram("http_request_duration_seconds", "Time from the request header to the end of the response",
+                                           ("method", "route"))
+HTTP_REQUEST_PHASE_DURATION = REGISTRY.histogram("http_request_phase_duration_seconds", "Time spent in each phase of a request", ("phase",))
+HTTP_SENT_BYTES = REGISTRY.counter("http_sent_bytes_total", "Bytes written to client connections, including headers")
+HTTP_RECEIVED_BYTES = REGISTRY.counter("http_received_bytes_total", "Bytes read from client connections, including headers")
+UPLOAD_BYTES = REGISTRY.counter("http_upload_bytes_total", "Bytes of uploaded files")
+UPLOAD_THROUGHPUT = REGISTRY.histogram("http_upload_throughput_bytes_per_second", "Throughput of single uploads", buckets=THROUGHPUT_BUCKETS)
+SQL_QUERY_DURATION = REGISTRY.histogram("sqlite_query_duration_seconds", "Duration of SQLite statements", ("operation",),
+                                        buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
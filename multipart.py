@@ -0,0 +1,121 @@
+import enum
+from typing import BinaryIO, Callable
+
+
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+class MultipartError(Exception):
+    pass
+
+class MultipartState(enum.Enum):
+    PREAMBLE = "preamble"
+    DELIMITER = "delimiter"
+    HEADERS = "headers"
+    BODY = "body"
+    DONE = "done"
+
+
+class MultipartParser:
+
+    def __init__(self, boundary : bytes, open_part : Callable[[dict], BinaryIO], max_header_size : int=MAX_PART_HEADER_SIZE):
+        self.delimiter = b"\r\n--" + boundary
+        self.open_part = open_part
+        self.max_header_size = max_header_size
+        self.state = MultipartState.PREAMBLE
+        # the first delimiter may start the body without a leading CRLF
+        self.buffer = bytearray(b"\r\n")
+        self.current_file = None
+        self.bytes_written = 0
+
+    def is_done(self) -> bool:
+        return self.state == MultipartState.DONE
+
+    def feed(self, data : bytes):
+        if self.state == MultipartState.DONE:
+            return
+        self.buffer += data
+        while True:
+            if self.state == MultipartState.PREAMBLE:
+                index = self.buffer.find(self.delimiter)
+                if index == -1:
+                    del self.buffer[:max(0, len(self.buffer) - len(self.delimiter) + 1)]
+                    return
+                del self.buffer[:index + len(self.delimiter)]
+                self.state = MultipartState.DELIMITER
+            elif self.state == MultipartState.DELIMITER:
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer.startswith(b"--"):
+                    self.buffer.clear()
+                    self.state = MultipartState.DONE
+                    return
+                index = self.buffer.find(b"\r\n")
+                if index == -1:
+                    if len(self.buffer) > self.max_header_size:
+                        raise MultipartError("Malformed multipart delimiter")
+                    return
+                # transport padding after the boundary is ignored
+                del self.buffer[:index + 2]
+                self.state = MultipartState.HEADERS
+            elif self.state == MultipartState.HEADERS:
+                if self.buffer.startswith(b"\r\n"):
+                    index = -2
+                else:
+                    index = self.buffer.find(b"\r\n\r\n")
+                if index == -1:
+                    if len(self.buffer) > self.max_header_size:
+                        raise MultipartError("Multipart headers too large")
+                    return
+                headers = self._parse_headers(bytes(self.buffer[:max(index, 0)]))
+                del self.buffer[:index + 4]
+                self.current_file = self.open_part(headers)
+                self.state = MultipartState.BODY
+            elif self.state == MultipartState.BODY:
+                index = self.buffer.find(self.delimiter)
+                if index == -1:
+                    safe = len(self.buffer) - len(self.delimiter) + 1
+                    if safe > 0:
+                        self._write(safe)
+                    return
+                self._write(index)
+                del self.buffer[:len(self.delimiter)]
+                self.current_file.close()
+                self.current_file = None
+                self.state = MultipartState.DELIMITER
+            else:
+                return
+
+    def close(self):
+        if self.current_file:
+            self.current_file.close()
+            self.current_file = None
+        self.buffer.clear()
+
+    def _write(self, size : int):
+        with memoryview(self.buffer) as view:
+            self.current_file.write(view[:size])
+        del self.buffer[:size]
+        self.bytes_written += size
+
+    @staticmethod
+    def _parse_headers(data : bytes) -> dict:
+        headers = dict()
+        for line in data.decode("utf-8").split("\r\n"):
+            if ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        return headers
+
+    @staticmethod
+    def get_filename(headers : dict) -> str:
+        content_disposition = headers.get("content-disposition", "")
+        for parameter in content_disposition.split(";")[1:]:
+            if "=" not in parameter:
+                continue
+            key, value = parameter.strip().split("=", 1)
+            if key.lower() == "filename":
+                if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+                    value = value[1:-1]
+                return value
+        return None
@@ -0,0 +1,118 @@
+import os
+import signal
+import time
+import traceback
+import metrics
+from log import LogLevel
+
+
+class Supervisor:
+
+    def __init__(self, server, workers : int, restart_delay : float=1.0, shutdown_timeout : float=10.0):
+        self.server = server
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.children = dict()
+        self.start_times = dict()
+        self.running = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if self.server.reuse_port:
+            # every worker binds its own SO_REUSEPORT socket, the kernel balances between them
+            self.server.close_sockets()
+        self.server.log.log(
+            LogLevel.INFO, f"Supervisor {os.getpid()} starting {self.workers} workers on {self.server.host}:{self.server.port}...")
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        while self.running:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None:
+                continue
+            self.server.log.log(
+                LogLevel.WARNING, f"Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+            if not self.running:
+                break
+            if time.monotonic() - self.start_times[worker_id] < self.restart_delay:
+                time.sleep(self.restart_delay)
+            if self.running:
+                self._spawn(worker_id)
+        self._shutdown()
+
+    def _spawn(self, worker_id : int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, self._exit_worker)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            # counters of the workers are separate series, a scrape reaching another worker does not reset them
+            metrics.REGISTRY.set_const_label("worker", str(worker_id))
+            code = 0
+            try:
+                if self.server.reuse_port:
+                    self.server.create_socket()
+                self.server.run()
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                try:
+                    self.server.sessions.close()
+                except BaseException:
+                    traceback.print_exc()
+                try:
+                    self.server.log.close()
+                finally:
+                    os._exit(code)
+        self.children[pid] = worker_id
+        self.start_times[worker_id] = time.monotonic()
+        self.server.log.log(
+            LogLevel.INFO, f"Worker {worker_id} started with pid {pid}")
+
+    @staticmethod
+    def _exit_worker(signum, frame):
+        raise SystemExit(0)
+
+    def _stop(self, signum, frame):
+        if not self.running:
+            return
+        self.running = False
+        self._signal_children(signal.SIGTERM)
+
+    def _signal_children(self, signum : int):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _shutdown(self):
+        self.running = False
+        self._signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            self.children.pop(pid, None)
+        if self.children:
+            self._signal_children(signal.SIGKILL)
+            for pid in list(self.children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self.children.clear()
+        self.server.log.log(
+            LogLevel.INFO, f"Supervisor {os.getpid()} stopped.")
@@ -0,0 +1,32 @@
+import unittest
+import utils
+
+
+class ParseRangesTest(unittest.TestCase):
+
+    def test_suffix_longer_than_file(self):
+        self.assertEqual(utils.parse_ranges("bytes=-500", 11), [(0, 10)])
+
+    def test_suffix(self):
+        self.assertEqual(utils.parse_ranges("bytes=-5", 11), [(6, 10)])
+
+    def test_end_past_eof_is_clamped(self):
+        self.assertEqual(utils.parse_ranges("bytes=0-999", 100), [(0, 99)])
+
+    def test_open_end(self):
+        self.assertEqual(utils.parse_ranges("bytes=90-", 100), [(90, 99)])
+
+    def test_start_past_eof_is_unsatisfiable(self):
+        self.assertIsNone(utils.parse_ranges("bytes=100-200", 100))
+        self.assertIsNone(utils.parse_ranges("bytes=-0", 100))
+        self.assertIsNone(utils.parse_ranges("bytes=0-10", 0))
+
+    def test_unsatisfiable_range_of_a_set_is_skipped(self):
+        self.assertEqual(utils.parse_ranges("bytes=0-9,500-600", 100), [(0, 9)])
+
+    def test_reversed_range(self):
+        self.assertIsNone(utils.parse_ranges("bytes=20-10", 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
 from http_server import HTTPServer
+from prefork import Supervisor
+from log import LogLevel
 from http_request import HTTPRequest
 from http_response import HTTPResponse
 
 import utils
 import argparse
+import signal
+import sys
 
 def generate_account(user, password):
     try:
@@ -18,8 +22,6 @@ def generate_test_accounts():
 
 
 if __name__ == "__main__":
-    utils.init_sql()
-    generate_test_accounts()
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--ip", type=str, default="localhost", help="Server IP address")
     parser.add_argument("-p", "--port", type=int, default=8080, help="Server port number")
@@ -28,6 +30,76 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--cookie-persist-time", type=int, default=3600, help="Cookie persist time in seconds")
     parser.add_argument("-d", "--debug", type=bool, help="Debug mode")
     parser.add_argument("-s", "--server", type=str, default="CS305 HTTP Server/1.0", help="Server name")
+    parser.add_argument("--engine", type=str, default="thread", choices=["thread", "pool", "async"], help="Connection engine, thread per connection, bounded worker pool or a single event loop")
+    parser.add_argument("--pool-min-workers", type=int, default=4, help="Minimum number of workers in pool engine")
+    parser.add_argument("--pool-max-workers", type=int, default=32, help="Maximum number of workers in pool engine")
+    parser.add_argument("--pool-queue-size", type=int, default=64, help="Maximum number of accepted connections waiting for a worker")
+    parser.add_argument("--pool-overflow", type=str, default="block", choices=["block", "reject"], help="Behavior when the accept queue is full")
+    parser.add_argument("--retry-after", type=int, default=5, help="Retry-After seconds of rejected connections")
+    parser.add_argument("--pool-stats-interval", type=float, default=60, help="Seconds between worker pool stats logs, 0 to disable")
+    parser.add_argument("--async-workers", type=int, default=32, help="Number of threads of the async engine serving parsed requests")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of pre-forked worker processes")
+    parser.add_argument("--reuse-port", action="store_true", help="Let every worker process bind its own socket with SO_REUSEPORT")
+    parser.add_argument("--max-header-size", type=int, default=64 * 1024, help="Maximum size of request headers in bytes")
+    parser.add_argument("--max-header-count", type=int, default=100, help="Maximum number of request headers")
+    parser.add_argument("--session-cache-size", type=int, default=10000, help="Maximum number of cached sessions")
+    parser.add_argument("--session-flush-interval", type=float, default=5.0, help="Seconds between batched cookie renewal writes")
+    parser.add_argument("--log-level", type=str, default="INFO", choices=[level.name for level in LogLevel], help="Minimum level of logged messages")
+    parser.add_argument("--log-max-bytes", type=int, default=0, help="Rotate the log file when it exceeds this size, 0 to disable")
+    parser.add_argument("--log-rotate-interval", type=float, default=0, help="Rotate the log file every this many seconds, 0 to disable")
+    parser.add_argument("--log-backup-count", type=int, default=5, help="Number of rotated log files to keep")
+    parser.add_argument("--no-compression", action="store_true", help="Disable gzip/deflate/zstd response compression")
+    parser.add_argument("--compression-min-size", type=int, default=1024, help="Minimum body size in bytes to compress")
+    parser.add_argument("--compression-level", type=int, default=6, help="Compression level")
+    parser.add_argument("--compression-cache-dir", type=str, default="cache", help="Directory of precompressed static files")
+    parser.add_argument("--compression-max-file-size", type=int, default=64 * 1024 * 1024, help="Largest file in bytes that is compressed")
+    parser.add_argument("--compression-cache-size", type=int, default=1024 * 1024 * 1024, help="Budget of the compressed file cache in bytes, 0 for unlimited")
+    parser.add_argument("--encrypt-session-lifetime", type=float, default=3600, help="Seconds an ENCRYPT session ticket can be resumed")
+    parser.add_argument("--tls-port", type=int, default=None, help="Additional port serving HTTPS, requires --cert and --key")
+    parser.add_argument("--cert", type=str, default=None, help="PEM certificate chain of the TLS listener")
+    parser.add_argument("--key", type=str, default=None, help="PEM private key of the TLS listener")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="Seconds a keep-alive connection may wait for its next request, defaults to --timeout")
+    parser.add_argument("--header-timeout", type=float, default=10, help="Seconds to receive the whole request header once it started")
+    parser.add_argument("--max-requests", type=int, default=100, help="Maximum number of requests served on one connection")
+    parser.add_argument("--max-connections", type=int, default=1024, help="Close the longest idle keep-alive connections above this many open connections, 0 to disable")
+    parser.add_argument("--linger-timeout", type=float, default=2.0, help="Seconds to drain a half closed connection before closing it")
+    parser.add_argument("--expose-metrics", action="store_true", help="Serve Prometheus metrics at /metrics on the main port")
+    parser.add_argument("--admin-port", type=int, default=None, help="Separate port serving /metrics and other admin endpoints")
+    parser.add_argument("--admin-host", type=str, default="127.0.0.1", help="Address the admin port binds to")
+    parser.add_argument("--slow-request-threshold", type=float, default=1.0, help="Log requests slower than this many seconds with their phase timings, 0 to disable")
+    parser.add_argument("--profile-dir", type=str, default="profiles", help="Directory of profiles triggered through the admin port")
+    parser.add_argument("--connection-rate-limit", type=int, default=0, help="Maximum file transfer rate of one connection in bytes per second, 0 for unlimited")
+    parser.add_argument("--user-rate-limit", type=int, default=0, help="Maximum file transfer rate of all connections of one user in bytes per second, 0 for unlimited")
+    parser.add_argument("--global-rate-limit", type=int, default=0, help="Maximum file transfer rate of the server process in bytes per second, 0 for unlimited")
+    parser.add_argument("--upload-session-dir", type=str, default="uploads", help="Directory of unfinished resumable uploads, should be on the file system of the data directory")
+    parser.add_argument("--upload-session-lifetime", type=float, default=24 * 3600, help="Seconds a resumable upload is kept after its last chunk")
+    parser.add_argument("--upload-max-length", type=int, default=64 * 1024 ** 3, help="Largest resumable upload in bytes, 0 for unlimited")
+    parser.add_argument("--max-body-size", type=int, default=0, help="Largest request body in bytes, chunked or with Content-Length, 0 for unlimited")
+    parser.add_argument("--remove-duplicate-users", action="store_true", help="Delete users registered again under an existing name instead of refusing to start")
     args = parser.parse_args()
-    server = HTTPServer(host=args.ip, port=args.port, parallel=args.parallel, timeout=args.timeout, cookie_persist_time=args.cookie_persist_time, debug=args.debug, server=args.server)
-    server.run()
\ No newline at end of file
+    if args.tls_port and not (args.cert and args.key):
+        parser.error("--tls-port requires --cert and --key")
+    server = HTTPServer(host=args.ip, port=args.port, parallel=args.parallel, timeout=args.timeout, cookie_persist_time=args.cookie_persist_time, debug=args.debug, server=args.server, engine=args.engine,
+                        pool_min_workers=args.pool_min_workers, pool_max_workers=args.pool_max_workers, pool_queue_size=args.pool_queue_size,
+                        pool_overflow=args.pool_overflow, retry_after=args.retry_after, pool_stats_interval=args.pool_stats_interval, async_workers=args.async_workers, reuse_port=args.reuse_port,
+                        max_header_size=args.max_header_size, max_header_count=args.max_header_count,
+                        session_cache_size=args.session_cache_size, session_flush_interval=args.session_flush_interval,
+                        log_level=args.log_level, log_max_bytes=args.log_max_bytes, log_rotate_interval=args.log_rotate_interval, log_backup_count=args.log_backup_count,
+                        compression=not args.no_compression, compression_min_size=args.compression_min_size, compression_level=args.compression_level,
+                        compression_cache_dir=args.compression_cache_dir, compression_max_file_size=args.compression_max_file_size, compression_cache_size=args.compression_cache_size,
+                        encrypt_session_lifetime=args.encrypt_session_lifetime,
+                        tls_port=args.tls_port, tls_cert=args.cert, tls_key=args.key,
+                        idle_timeout=args.idle_timeout, header_timeout=args.header_timeout, max_requests=args.max_requests,
+                        max_connections=args.max_connections, linger_timeout=args.linger_timeout,
+                        expose_metrics=args.expose_metrics, admin_host=args.admin_host, admin_port=args.admin_port,
+                        slow_request_threshold=args.slow_request_threshold, profile_dir=args.profile_dir,
+                        connection_rate_limit=args.connection_rate_limit, user_rate_limit=args.user_rate_limit, global_rate_limit=args.global_rate_limit,
+                        upload_session_dir=args.upload_session_dir, upload_session_lifetime=args.upload_session_lifetime, upload_max_length=args.upload_max_length,
+                        max_body_size=args.max_body_size, remove_duplicate_users=args.remove_duplicate_users)
+    generate_test_accounts()
+    if args.workers > 1:
+        Supervisor(server, args.workers).run()
+    else:
+        # exit through SystemExit so pending log messages and cookie renewals are flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server.run()
\ No newline at end of file
@@ -0,0 +1,84 @@
+import atexit
+import os
+import threading
+import uuid as ud
+from datetime import datetime, timedelta
+import utils
+from ttl_cache import TTLCache
+
+
+class SessionCache:
+
+    def __init__(self, max_size : int=10000, ttl : float=60.0, flush_interval : float=5.0):
+        self.sessions = TTLCache(max_size, ttl)
+        self.users = TTLCache(max_size, ttl)
+        self.flush_interval = flush_interval
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.flusher_pid = None
+        self.stopped = threading.Event()
+        atexit.register(self.flush)
+
+    def get(self, cookie : ud.UUID) -> (ud.UUID, str):
+        session = self.sessions.get(cookie)
+        if session is None:
+            session = utils.get_session_by_cookie(cookie)
+            if session is None:
+                return None
+            self.sessions.set(cookie, session)
+        user_uuid, user_name, expire_time = session
+        if expire_time < utils.get_current_time().replace(tzinfo=None):
+            self.sessions.pop(cookie)
+            with self.lock:
+                self.pending.pop(cookie, None)
+            utils.clean_cookie_by_cookie(cookie)
+            return None
+        return user_uuid, user_name
+
+    def get_user_by_name(self, user_name : str) -> ud.UUID:
+        user_uuid = self.users.get(user_name.lower())
+        if user_uuid is None:
+            user_uuid = utils.get_user_by_name(user_name)
+            if user_uuid is not None:
+                self.users.set(user_name.lower(), user_uuid)
+        return user_uuid
+
+    def renew(self, cookie : ud.UUID, persist_time : int):
+        expire_time = utils.get_current_time().replace(tzinfo=None, microsecond=0) + timedelta(seconds=persist_time)
+        session = self.sessions.get(cookie)
+        if session is not None:
+            self.sessions.set(cookie, (session[0], session[1], expire_time))
+        with self.lock:
+            self.pending[cookie] = expire_time
+        self._ensure_flusher()
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = dict()
+        if pending:
+            utils.resign_cookies(pending)
+
+    def _ensure_flusher(self):
+        # the flusher thread does not survive a fork into a worker process
+        if self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        flusher = threading.Thread(target=self._flush_loop, name="session-flusher")
+        flusher.daemon = True
+        flusher.start()
+
+    def close(self):
+        # os._exit in a worker skips atexit, the pending renewals are written here instead
+        self.stopped.set()
+        self.flush()
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                pass
@@ -0,0 +1,70 @@
+import os
+import sqlite3 as sql
+import threading
+import time
+from metrics import SQL_QUERY_DURATION
+
+
+class TimedConnection(sql.Connection):
+
+    def execute(self, statement : str, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(statement, *args)
+        finally:
+            self._observe(statement, start)
+
+    def executemany(self, statement : str, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(statement, *args)
+        finally:
+            self._observe(statement, start)
+
+    @staticmethod
+    def _observe(statement : str, start : float):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        SQL_QUERY_DURATION.labels(operation).observe(time.perf_counter() - start)
+
+
+class SQLConnectionPool:
+
+    def __init__(self, database : str, busy_timeout : float=5.0, cached_statements : int=128):
+        self.database = database
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+
+    def get_connection(self) -> sql.Connection:
+        conn = getattr(self.local, "conn", None)
+        # connections must not be shared with a forked worker process
+        if conn is None or self.local.pid != os.getpid():
+            conn = self._connect()
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def _connect(self) -> sql.Connection:
+        conn = sql.connect(self.database, timeout=self.busy_timeout, cached_statements=self.cached_statements, factory=TimedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.pid == os.getpid():
+            conn.close()
+        self.local.conn = None
+
+
+pools = dict()
+pools_lock = threading.Lock()
+
+def get_connection(database : str) -> sql.Connection:
+    pool = pools.get(database)
+    if pool is None:
+        with pools_lock:
+            pool = pools.setdefault(database, SQLConnectionPool(database))
+    return pool.get_connection()
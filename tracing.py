@@ -0,0 +1,150 @@
+import cProfile
+import collections
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from log import Log, LogLevel
+
+
+PROFILE_MODES = ("cprofile", "stack")
+
+_local = threading.local()
+
+class RequestTrace:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = dict()
+        self.profile = None
+
+    def mark(self, phase : str):
+        # the time since the previous mark is charged to this phase
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def format(self) -> str:
+        return " ".join(f"{phase}={duration * 1000:.1f}ms" for phase, duration in self.phases.items())
+
+def begin() -> RequestTrace:
+    _local.trace = RequestTrace()
+    return _local.trace
+
+def end():
+    _local.trace = None
+
+def mark(phase : str):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.mark(phase)
+
+
+class Profiler:
+
+    def __init__(self, output_dir : str="profiles", log : Log=None):
+        self.output_dir = output_dir
+        self.log = log
+        self.lock = threading.Lock()
+        # checked on every request, everything else only runs while profiling
+        self.running = False
+        self.mode = None
+        self.sample_rate = 1.0
+        self.interval = 0.005
+        self.stats = None
+        self.stacks = None
+        self.path = None
+
+    def start(self, mode : str, seconds : float, sample_rate : float=1.0, interval : float=0.005) -> str:
+        with self.lock:
+            if self.running:
+                return None
+            os.makedirs(self.output_dir, exist_ok=True)
+            extension = "pstats" if mode == "cprofile" else "folded"
+            self.path = os.path.join(self.output_dir, f"profile_{os.getpid()}_{time.strftime('%Y%m%d_%H%M%S')}.{extension}")
+            self.mode = mode
+            self.sample_rate = sample_rate
+            self.interval = interval
+            self.stats = None
+            self.stacks = collections.Counter()
+            self.running = True
+        if mode == "stack":
+            sampler = threading.Thread(target=self._sample_loop, args=(time.monotonic() + seconds,), name="stack-sampler")
+            sampler.daemon = True
+            sampler.start()
+        else:
+            timer = threading.Timer(seconds, self._finish)
+            timer.daemon = True
+            timer.start()
+        if self.log:
+            self.log.log(LogLevel.INFO, f"Profiling with {mode} for {seconds}s into {self.path}")
+        return self.path
+
+    def attach(self, trace : RequestTrace):
+        if self.mode != "cprofile" or random.random() >= self.sample_rate:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # since 3.12 only one profiler can be active at a time, concurrent requests are skipped
+            return
+        trace.profile = profile
+
+    def detach(self, trace : RequestTrace):
+        profile = trace.profile
+        if profile is None:
+            return
+        trace.profile = None
+        profile.disable()
+        with self.lock:
+            if not self.running or self.mode != "cprofile":
+                return
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def _sample_loop(self, deadline : float):
+        own = threading.get_ident()
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        self._finish()
+
+    def _finish(self):
+        with self.lock:
+            self.running = False
+            try:
+                if self.mode == "cprofile":
+                    if self.stats is None:
+                        if self.log:
+                            self.log.log(LogLevel.INFO, f"No request was profiled, {self.path} is not written")
+                        return
+                    self.stats.dump_stats(self.path)
+                else:
+                    # collapsed stacks, the input format of flamegraph.pl and speedscope
+                    with open(self.path, "w") as f:
+                        for stack, count in self.stacks.most_common():
+                            f.write(f"{stack} {count}\n")
+            except OSError as e:
+                if self.log:
+                    self.log.log(LogLevel.ERROR, f"Writing profile {self.path} failed: {e}")
+                return
+            self.stats = None
+            self.stacks = None
+        if self.log:
+            self.log.log(LogLevel.INFO, f"Profile written to {self.path}")
@@ -0,0 +1,212 @@
+import errno
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid as ud
+
+
+SESSION_ID_LENGTH = 32
+# user names that cannot be registered, their directories would be shadowed by the session routes
+RESERVED_NAMES = ("uploads",)
+SWEEP_INTERVAL = 60
+DEFAULT_MAX_LENGTH = 64 * 1024 ** 3
+
+class UploadSessionError(Exception):
+
+    def __init__(self, status_code : int, reason : str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+def merge_ranges(ranges : list) -> list:
+    result = []
+    for start, end in sorted(ranges):
+        if result and start <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    return result
+
+def format_ranges(ranges : list) -> str:
+    return ",".join(f"{start}-{end}" for start, end in ranges)
+
+def parse_content_range(content_range : str, length : int) -> (int, int):
+    # bytes <start>-<end>/<total>, the total may be * or has to match the session
+    unit, _, spec = content_range.strip().partition(" ")
+    span, _, total = spec.partition("/")
+    start, _, end = span.partition("-")
+    try:
+        if unit.lower() != "bytes" or (total != "*" and int(total) != length):
+            return None
+        start, end = int(start), int(end)
+    except ValueError:
+        return None
+    if start < 0 or end < start or end >= length:
+        return None
+    return start, end
+
+
+class UploadSessionStore:
+
+    # every session is a directory with its metadata, a sparse data file and an append-only log
+    # of written ranges, so any worker process can serve any chunk without shared memory or locks
+
+    def __init__(self, session_dir : str, lifetime : float=24 * 3600, max_length : int=DEFAULT_MAX_LENGTH):
+        self.session_dir = session_dir
+        self.lifetime = lifetime
+        self.max_length = max_length
+        self.last_sweep = 0.0
+        self.lock = threading.Lock()
+
+    def _path(self, session_id : str, name : str="") -> str:
+        if len(session_id) != SESSION_ID_LENGTH or not all(c in "0123456789abcdef" for c in session_id):
+            raise UploadSessionError(404, "Upload Session Not Found")
+        return os.path.join(self.session_dir, session_id, name)
+
+    def create(self, user : str, target_dir : str, file_name : str, length : int) -> str:
+        if length < 0 or (self.max_length and length > self.max_length):
+            raise UploadSessionError(413, "Upload Too Large")
+        self.sweep()
+        os.makedirs(self.session_dir, exist_ok=True)
+        # the data files are sparse, the space still missing of every open session is kept free for it
+        if shutil.disk_usage(self.session_dir).free < self._reserved() + length:
+            raise UploadSessionError(507, "Insufficient Storage")
+        session_id = ud.uuid4().hex
+        os.makedirs(self._path(session_id))
+        open(self._path(session_id, "ranges"), "wb").close()
+        with open(self._path(session_id, "data"), "wb") as f:
+            f.truncate(length)
+        with open(self._path(session_id, "meta.json"), "w") as f:
+            json.dump({"user": user.lower(), "dir": target_dir, "name": file_name, "length": length, "created": time.time()}, f)
+        return session_id
+
+    def get(self, session_id : str, user : str) -> dict:
+        # expired sessions free their reserved space without waiting for the next create
+        self.sweep()
+        try:
+            with open(self._path(session_id, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise UploadSessionError(404, "Upload Session Not Found")
+        # user names are case insensitive
+        if meta["user"].lower() != user.lower():
+            raise UploadSessionError(403, "Forbidden")
+        if self.expires(session_id) < time.time():
+            self.abort(session_id)
+            raise UploadSessionError(404, "Upload Session Not Found")
+        meta["id"] = session_id
+        return meta
+
+    def _reserved(self) -> int:
+        reserved = 0
+        for session_id in os.listdir(self.session_dir):
+            try:
+                with open(self._path(session_id, "meta.json")) as f:
+                    length = json.load(f)["length"]
+                reserved += length - sum(end - start + 1 for start, end in self.ranges(session_id))
+            except (OSError, ValueError, KeyError, UploadSessionError):
+                continue
+        return max(0, reserved)
+
+    def expires(self, session_id : str) -> float:
+        try:
+            # every stored chunk extends the session
+            return os.stat(self._path(session_id, "ranges")).st_mtime + self.lifetime
+        except OSError:
+            return 0.0
+
+    def ranges(self, session_id : str) -> list:
+        with open(self._path(session_id, "ranges")) as f:
+            ranges = [tuple(int(value) for value in line.split()) for line in f if line.endswith("\n")]
+        return merge_ranges(ranges)
+
+    def write(self, session_id : str, start : int, chunks) -> int:
+        # chunks yields the body, what was written is recorded even if the body is cut short
+        written = 0
+        fd = os.open(self._path(session_id, "data"), os.O_WRONLY)
+        try:
+            # chunks share the lock, a commit takes it exclusively and keeps later chunks out
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if os.path.exists(self._path(session_id, "committing")):
+                raise UploadSessionError(409, "Upload Is Being Committed")
+            for data in chunks:
+                os.pwrite(fd, data, start + written)
+                written += len(data)
+        finally:
+            try:
+                # recorded while the lock is held, a commit then sees every finished chunk
+                if written:
+                    self._record(session_id, start, start + written - 1)
+            finally:
+                os.close(fd)
+        return written
+
+    def _record(self, session_id : str, start : int, end : int):
+        # a single short O_APPEND write is atomic, concurrent chunks do not need a lock
+        fd = os.open(self._path(session_id, "ranges"), os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, f"{start} {end}\n".encode())
+        finally:
+            os.close(fd)
+
+    def commit(self, meta : dict, target_path : str):
+        marker = self._path(meta["id"], "committing")
+        try:
+            os.close(os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            raise UploadSessionError(409, "Upload Is Being Committed")
+        data_path = self._path(meta["id"], "data")
+        fd = os.open(data_path, os.O_RDONLY)
+        try:
+            # waits for the chunks still being written
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._link(meta, data_path, target_path)
+        except BaseException:
+            # the upload can go on after a failed commit
+            os.remove(marker)
+            raise
+        finally:
+            os.close(fd)
+        self.abort(meta["id"])
+
+    def _link(self, meta : dict, data_path : str, target_path : str):
+        if self.ranges(meta["id"]) != ([(0, meta["length"] - 1)] if meta["length"] else []):
+            raise UploadSessionError(409, "Upload Incomplete")
+        try:
+            os.link(data_path, target_path)
+        except FileExistsError:
+            raise UploadSessionError(409, "File already exists")
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+                raise
+            # another file system or no hard links, copy next to the target and rename it in place
+            part_path = os.path.join(os.path.dirname(target_path), f".{meta['id']}.part")
+            shutil.copyfile(data_path, part_path)
+            if os.path.exists(target_path):
+                os.remove(part_path)
+                raise UploadSessionError(409, "File already exists")
+            os.replace(part_path, target_path)
+
+    def abort(self, session_id : str):
+        shutil.rmtree(self._path(session_id), ignore_errors=True)
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            if now - self.last_sweep < SWEEP_INTERVAL:
+                return
+            self.last_sweep = now
+        try:
+            session_ids = os.listdir(self.session_dir)
+        except FileNotFoundError:
+            return
+        for session_id in session_ids:
+            try:
+                if self.expires(session_id) < now:
+                    self.abort(session_id)
+            except UploadSessionError:
+                continue
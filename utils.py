@@ -1,9 +1,17 @@
-import sqlite3 as sql
 import os
+import base64
+import bisect
+import json
 import uuid as ud
 import pytz
 from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
 from jinja2 import Template
+from sql_pool import get_connection
+from dir_cache import DirectoryCache, iter_entries
+import tracing
+from log import Log, LogLevel
+from typing import Callable, Iterable, Iterator
 
 user_data_file = "user_data.db"
 cookie_file = "user_data.db"
@@ -14,27 +22,37 @@ def get_current_time() -> datetime:
     current_time_gmt = current_time.astimezone(gmt_timezone)
     return current_time_gmt
 
-def init_sql():
-    conn = sql.connect(user_data_file)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS users (uuid TEXT PRIMARY KEY, name TEXT NOT NULL, password TEXT NOT NULL)")
-    conn.commit()
-    conn.close()
+class DuplicateUserError(Exception):
+    pass
 
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS cookies (cookie TEXT PRIMARY KEY, uuid TEXT NOT NULL, expire_time DATETIME NOT NULL)")
-    conn.commit()
-    conn.close()
+def init_sql(log : Log, remove_duplicate_users : bool=False):
+    conn = get_connection(user_data_file)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users (uuid TEXT PRIMARY KEY, name TEXT NOT NULL, password TEXT NOT NULL)")
+        # registrations racing before the index existed may have stored a name twice, logins by name
+        # always found the first row, the later ones are only removed when asked to
+        duplicates = conn.execute("SELECT uuid, name FROM users WHERE rowid NOT IN (SELECT MIN(rowid) FROM users GROUP BY LOWER(name)) ORDER BY rowid").fetchall()
+        if duplicates and not remove_duplicate_users:
+            names = ", ".join(f"{name} ({uuid})" for uuid, name in duplicates)
+            message = (f"User names registered more than once: {names}. Remove these later registrations "
+                       f"or start with --remove-duplicate-users to delete them and their sessions")
+            log.log(LogLevel.FATAL, message)
+            raise DuplicateUserError(message)
+        for uuid, name in duplicates:
+            log.log(LogLevel.WARNING, f"Removing duplicate user {name} ({uuid}), the first registration is kept")
+            conn.execute("DELETE FROM users WHERE uuid = ?", (uuid,))
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_name ON users (name)")
+
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS cookies (cookie TEXT PRIMARY KEY, uuid TEXT NOT NULL, expire_time DATETIME NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cookies_uuid ON cookies (uuid)")
+        conn.executemany("DELETE FROM cookies WHERE uuid = ?", [(uuid,) for uuid, _ in duplicates])
 
 def verify_user(uuid : ud.UUID, password : str) -> bool:
-    conn = sql.connect(user_data_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE uuid = ? AND password = ?", (str(uuid), password))
-    if cursor.fetchone() is None:
-        return False
-    else:
-        return True
+    conn = get_connection(user_data_file)
+    cursor = conn.execute("SELECT 1 FROM users WHERE uuid = ? AND password = ?", (str(uuid), password))
+    return cursor.fetchone() is not None
     
 def get_root_dir() -> str:
     return f".{ os.path.sep } "
@@ -57,17 +75,14 @@ def create_user(user_name : str, password : str) -> ud.UUID:
         raise Exception("User already exists.")
     uuid = ud.uuid4()
     generate_folder(user_name.lower())
-    conn = sql.connect(user_data_file)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO users VALUES (?, ?, ?)", (str(uuid), user_name.lower(), password))
-    conn.commit()
-    conn.close()
+    conn = get_connection(user_data_file)
+    with conn:
+        conn.execute("INSERT INTO users VALUES (?, ?, ?)", (str(uuid), user_name.lower(), password))
     return uuid
 
 def get_user_by_name(user_name : str) -> ud.UUID:
-    conn = sql.connect(user_data_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT uuid FROM users WHERE name = ?", (user_name.lower(),))
+    conn = get_connection(user_data_file)
+    cursor = conn.execute("SELECT uuid FROM users WHERE name = ?", (user_name.lower(),))
     result = cursor.fetchone()
     if result is None:
         return None
@@ -75,9 +90,8 @@ def get_user_by_name(user_name : str) -> ud.UUID:
         return ud.UUID(result[0])
 
 def get_user_name_by_uuid(uuid : ud.UUID) -> str:
-    conn = sql.connect(user_data_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM users WHERE uuid = ?", (str(uuid),))
+    conn = get_connection(user_data_file)
+    cursor = conn.execute("SELECT name FROM users WHERE uuid = ?", (str(uuid),))
     result = cursor.fetchone()
     if result is None:
         return None
@@ -85,9 +99,8 @@ def get_user_name_by_uuid(uuid : ud.UUID) -> str:
         return result[0]
 
 def get_user_by_cookie(cookie : ud.UUID) -> ud.UUID:
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT uuid, expire_time FROM cookies WHERE cookie = ?", (str(cookie),))
+    conn = get_connection(cookie_file)
+    cursor = conn.execute("SELECT uuid, expire_time FROM cookies WHERE cookie = ?", (str(cookie),))
     result = cursor.fetchone()
     if result is None:
         return None
@@ -100,9 +113,8 @@ def get_user_by_cookie(cookie : ud.UUID) -> ud.UUID:
         return ud.UUID(result[0])
     
 def get_cookie_by_user(uuid : ud.UUID) -> ud.UUID:
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT cookie, expire_time FROM cookies WHERE uuid = ?", (str(uuid),))
+    conn = get_connection(cookie_file)
+    cursor = conn.execute("SELECT cookie, expire_time FROM cookies WHERE uuid = ?", (str(uuid),))
     result = cursor.fetchone()
     if result is None:
         return None
@@ -114,45 +126,49 @@ def get_cookie_by_user(uuid : ud.UUID) -> ud.UUID:
             return None
         return ud.UUID(result[0])
     
+def get_session_by_cookie(cookie : ud.UUID) -> (ud.UUID, str, datetime):
+    conn = get_connection(cookie_file)
+    cursor = conn.execute("SELECT cookies.uuid, users.name, cookies.expire_time FROM cookies JOIN users ON users.uuid = cookies.uuid WHERE cookies.cookie = ?", (str(cookie),))
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    return ud.UUID(result[0]), result[1], datetime.strptime(result[2], "%Y-%m-%d %H:%M:%S")
+
 def generate_cookie(uuid : ud.UUID, persist_time : int=120) -> ud.UUID:
     cookie = ud.uuid4()
     set_cookie(uuid, cookie, persist_time)
     return cookie
 
 def resign_cookie(cookie : ud.UUID, persist_time: int):
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE cookies SET expire_time = datetime('now', '+{} seconds') WHERE cookie = ?".format(persist_time), (str(cookie),))
-    conn.commit()
-    conn.close()
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("UPDATE cookies SET expire_time = datetime('now', ?) WHERE cookie = ?", (f"+{persist_time} seconds", str(cookie)))
+
+def resign_cookies(expire_times : dict):
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.executemany("UPDATE cookies SET expire_time = ? WHERE cookie = ?",
+                         [(expire_time.strftime("%Y-%m-%d %H:%M:%S"), str(cookie)) for cookie, expire_time in expire_times.items()])
 
 def set_cookie(uuid : ud.UUID, cookie : ud.UUID, persist_time : int):
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO cookies VALUES (?, ?, datetime('now', '+{} seconds'))".format(persist_time), (str(cookie), str(uuid)))
-    conn.commit()
-    conn.close()
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("INSERT INTO cookies VALUES (?, ?, datetime('now', ?))", (str(cookie), str(uuid), f"+{persist_time} seconds"))
 
 def clean_cookie():
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cookies WHERE expire_time < datetime('now')")
-    conn.commit()
-    conn.close()
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("DELETE FROM cookies WHERE expire_time < datetime('now')")
 
 def clean_cookie_by_user(uuid : ud.UUID):
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cookies WHERE uuid = ?", (str(uuid),))
-    conn.commit()
-    conn.close()
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("DELETE FROM cookies WHERE uuid = ?", (str(uuid),))
 
 def clean_cookie_by_cookie(cookie : ud.UUID):
-    conn = sql.connect(cookie_file)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM cookies WHERE cookie = ?", (str(cookie),))
-    conn.commit()
-    conn.close()
+    conn = get_connection(cookie_file)
+    with conn:
+        conn.execute("DELETE FROM cookies WHERE cookie = ?", (str(cookie),))
 
 login_template = None
 
@@ -167,48 +183,146 @@ def login_html():
 
 
 file_explore_template = None
+directory_cache = DirectoryCache()
 
 def file_explore_html(dir : str, user_name : str, abs_dir : str, uuid : ud.UUID=None, sustech_http : bool=False) -> str:
-    global file_explore_template
-    abs_files = os.listdir(abs_dir)
+    return file_explore_entity(dir, user_name, abs_dir, sustech_http=sustech_http)[0]
 
+def file_explore_entity(dir : str, user_name : str, abs_dir : str, sustech_http : bool=False, revalidate : bool=False) -> (str, str, float):
+    # revalidate rescans a cached directory, file sizes change without touching its mtime
     if sustech_http:
-        files = []
-        for file in abs_files:
-            file_name = os.path.basename(file)
-            if os.path.isdir(os.path.join(abs_dir, file_name)):
-                files.append(file_name + "/")
-            else:
-                files.append(file_name)
-        files.sort()
-        return str(files)
+        return directory_cache.get_rendered(abs_dir, ("sustech",), traced_render(render_sustech_listing), revalidate)
+    return directory_cache.get_rendered(abs_dir, ("html", dir, user_name),
+                                        traced_render(lambda entries: render_file_explore_html(dir, user_name, entries)), revalidate)
+
+def traced_render(render : Callable[[list], str]) -> Callable[[list], str]:
+    def render_entries(entries : list) -> str:
+        # a cache miss scans the directory before rendering
+        tracing.mark("filesystem")
+        html = render(entries)
+        tracing.mark("render")
+        return html
+    return render_entries
+
+def render_sustech_listing(entries : list) -> str:
+    files = [name + "/" if is_dir else name for name, is_dir, _, _ in entries]
+    files.sort()
+    return str(files)
+
+def get_file_explore_template() -> Template:
+    global file_explore_template
     if file_explore_template is None:
         with open("view_files.html", "r", encoding="utf-8") as template_file:
             template_content = template_file.read()
         file_explore_template = Template(template_content)
-    files = [("/" + user_name + "/", "/", True, -1)]
+    return file_explore_template
+
+def _file_explore_items(dir : str, user_name : str, entries : Iterable[tuple]) -> Iterator[tuple]:
+    yield ("/" + user_name + "/", "/", True, -1)
 
     if dir.lower() != user_name:
-        files.append(("../", "../", True, -1))
+        yield ("../", "../", True, -1)
 
-    for file in abs_files:
-        file_name = os.path.basename(file)
-        if os.path.isdir(os.path.join(abs_dir, file)):
-            files.append(("/" + dir.replace("%", "%25") + "/" + file_name.replace("%", "%25") + "/", file_name + "/", True, -1))
+    quoted_dir = "/" + dir.replace("%", "%25") + "/"
+    for file_name, is_dir, size, _ in entries:
+        if is_dir:
+            yield (quoted_dir + file_name.replace("%", "%25") + "/", file_name + "/", True, -1)
         else:
-            files.append(("/" + dir.replace("%", "%25") + "/" + file_name.replace("%", "%25"), file_name, False, os.path.getsize(os.path.join(abs_dir, file_name))))
-        
-    if len(files) > 2:
-        ret = [files[0]]
-        files = files[1:]
-        files.sort(key=lambda x: (not x[2], x[1]))
-        ret.extend(files)
-        files = ret
-    
-    rendered_html = file_explore_template.render(files=files, user_name=user_name, current_path=dir)
+            yield (quoted_dir + file_name.replace("%", "%25"), file_name, False, size)
+
+def render_file_explore_html(dir : str, user_name : str, entries : list) -> str:
+    files = list(_file_explore_items(dir, user_name, entries))
+    rendered_html = get_file_explore_template().render(files=files, user_name=user_name, current_path=dir)
 
     return rendered_html
 
+def file_explore_html_stream(dir : str, user_name : str, abs_dir : str) -> Iterator[str]:
+    # entries are rendered in directory order while the directory is still being scanned
+    files = _file_explore_items(dir, user_name, iter_entries(abs_dir))
+    return get_file_explore_template().generate(files=files, user_name=user_name, current_path=dir)
+
+LISTING_SORT_KEYS = {
+    "name": lambda entry: (entry[0],),
+    "type": lambda entry: (0 if entry[1] else 1, entry[0]),
+    "size": lambda entry: (entry[2], entry[0]),
+}
+# element types of the sort keys, a cursor key is only compared with keys of the same shape
+LISTING_KEY_TYPES = {
+    "name": (str,),
+    "type": (int, str),
+    "size": (int, str),
+}
+
+def encode_listing_cursor(sort : str, order : str, key : tuple) -> str:
+    data = json.dumps([sort, order, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_listing_cursor(cursor : str, sort : str, order : str) -> tuple:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, key = json.loads(data)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_order != order:
+        raise ValueError("Cursor does not match sort and order")
+    types = LISTING_KEY_TYPES[sort]
+    if not isinstance(key, list) or len(key) != len(types) or \
+            not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+def list_directory(dir : str, abs_dir : str, sort : str="type", order : str="asc", limit : int=1000, cursor : str=None) -> dict:
+    if sort not in LISTING_SORT_KEYS:
+        raise ValueError(f"Unknown sort key {sort}")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unknown order {order}")
+    if limit <= 0:
+        raise ValueError("Limit must be positive")
+    listing, entries, keys = directory_cache.get_sorted(abs_dir, sort, LISTING_SORT_KEYS[sort])
+    if order == "asc":
+        start = bisect.bisect_right(keys, decode_listing_cursor(cursor, sort, order)) if cursor else 0
+        end = min(start + limit, len(entries))
+        page = entries[start:end]
+        has_more = end < len(entries)
+    else:
+        end = bisect.bisect_left(keys, decode_listing_cursor(cursor, sort, order)) if cursor else len(entries)
+        start = max(0, end - limit)
+        page = entries[start:end][::-1]
+        has_more = start > 0
+    return {
+        "path": "/" + dir,
+        "total": len(entries),
+        "entries": [{"name": name, "type": "directory" if is_dir else "file", "size": size, "mtime": mtime} for name, is_dir, size, mtime in page],
+        "next_cursor": encode_listing_cursor(sort, order, LISTING_SORT_KEYS[sort](page[-1])) if has_more and page else None,
+    }
+
+def http_date(timestamp : float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+def parse_http_date(value : str) -> float:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def file_etag(stat : os.stat_result) -> str:
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def etag_matches(header : str, etag : str, weak : bool=True) -> bool:
+    if header.strip() == "*":
+        return True
+    if not weak and etag.startswith("W/"):
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == (etag[2:] if etag.startswith("W/") else etag):
+            return True
+    return False
+
 def filter_path(path : str) -> str:
     path = path.replace("//", "/")
 
@@ -224,20 +338,28 @@ def normalize_and_validate_path(base_path : str, request_uri : str) -> str:
     
     return normalized_path
 
+HEX_DIGITS = "0123456789abcdefABCDEF"
+HEX_BYTES = {(high + low).encode(): bytes([int(high + low, 16)]) for high in HEX_DIGITS for low in HEX_DIGITS}
+
 def unquote_uri(s):
-    decoded_bytes = bytes()
-    i = 0
-    while i < len(s):
-        if s[i] == '%':
-            decoded_bytes += int(s[i + 1:i + 3], 16).to_bytes(1, 'big')
-            i += 3
-        else:
-            decoded_bytes += s[i].encode('utf-8')
-            i += 1
+    if '%' not in s:
+        return s
+    parts = s.encode('utf-8').split(b'%')
+    chunks = [parts[0]]
+    for part in parts[1:]:
+        byte = HEX_BYTES.get(part[:2])
+        if byte is None:
+            byte = bytes([int(part[:2], 16)])
+        chunks.append(byte)
+        chunks.append(part[2:])
 
-    return decoded_bytes.decode('utf-8')
+    return b"".join(chunks).decode('utf-8')
 
-def parse_ranges(ranges : str, file_size : int) -> list[tuple]:
+# ranges closer than the header of an extra multipart part are sent as one
+RANGE_COALESCE_GAP = 80
+MAX_RANGE_PARTS = 16
+
+def parse_ranges(ranges : str, file_size : int, max_parts : int=MAX_RANGE_PARTS) -> list[tuple]:
     if ranges.lower().startswith("bytes="):
         ranges = ranges[len("bytes="):]
     ranges = ranges.split(",")
@@ -269,9 +391,25 @@ def parse_ranges(ranges : str, file_size : int) -> list[tuple]:
                 end = int(parts[1])
         if start > end:
             return None
+        # a suffix longer than the file starts at its beginning, an end past it is clamped
+        start = max(0, start)
+        end = min(end, file_size - 1)
         if start >= file_size:
-            return None
-        if end >= file_size:
-            return None
+            # unsatisfiable ranges of a set are skipped, only an empty set is answered with 416
+            continue
         result.append((start, end))
+    if not result:
+        return None
+    return coalesce_ranges(result, max_parts)
+
+def coalesce_ranges(ranges : list[tuple], max_parts : int=MAX_RANGE_PARTS) -> list[tuple]:
+    result = []
+    for start, end in sorted(ranges):
+        if result and start <= result[-1][1] + 1 + RANGE_COALESCE_GAP:
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    if len(result) > max_parts:
+        # too many scattered ranges, send their span instead of amplifying small requests
+        result = [(result[0][0], result[-1][1])]
     return result
\ No newline at end of file
@@ -0,0 +1,120 @@
+import enum
+import queue
+import socket
+import threading
+import time
+from typing import Callable
+from log import Log, LogLevel
+
+
+class OverflowPolicy(enum.Enum):
+    BLOCK = "block"
+    REJECT = "reject"
+
+
+class WorkerPool:
+
+    def __init__(self, handler : Callable[[socket.socket, tuple], None], reject_handler : Callable[[socket.socket, tuple], None]=None, min_workers : int=4, max_workers : int=32, queue_size : int=64, overflow : OverflowPolicy=OverflowPolicy.BLOCK, idle_timeout : float=30.0, log : Log=None, stats_interval : float=0):
+        self.handler = handler
+        self.reject_handler = reject_handler
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.overflow = overflow
+        self.idle_timeout = idle_timeout
+        self.log = log
+        self.stats_interval = stats_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle_workers = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.served = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def start(self):
+        with self.lock:
+            for _ in range(self.min_workers):
+                self._spawn_worker()
+        if self.log and self.stats_interval > 0:
+            reporter = threading.Thread(target=self._report, name="http-pool-stats")
+            reporter.daemon = True
+            reporter.start()
+
+    def submit(self, conn : socket.socket, addr : tuple) -> bool:
+        with self.lock:
+            if self.idle_workers <= self.queue.qsize() and self.workers < self.max_workers:
+                self._spawn_worker()
+        item = (conn, addr, time.monotonic())
+        if self.overflow == OverflowPolicy.BLOCK:
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self.lock:
+                    self.rejected += 1
+                if self.reject_handler:
+                    self.reject_handler(conn, addr)
+                else:
+                    conn.close()
+                return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "workers": self.workers,
+                "busy_workers": self.workers - self.idle_workers,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "served": self.served,
+                "avg_wait_time": self.total_wait_time / self.served if self.served else 0.0,
+                "max_wait_time": self.max_wait_time,
+            }
+
+    def _spawn_worker(self):
+        self.workers += 1
+        self.idle_workers += 1
+        worker = threading.Thread(target=self._work, name=f"http-worker-{self.workers}")
+        worker.daemon = True
+        worker.start()
+
+    def _work(self):
+        while True:
+            try:
+                conn, addr, enqueue_time = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    if self.workers > self.min_workers:
+                        self.workers -= 1
+                        self.idle_workers -= 1
+                        return
+                continue
+            wait_time = time.monotonic() - enqueue_time
+            with self.lock:
+                self.idle_workers -= 1
+                self.served += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+            try:
+                self.handler(conn, addr)
+            except Exception as e:
+                if self.log:
+                    self.log.log(LogLevel.ERROR, f"Worker error: {e}")
+            finally:
+                with self.lock:
+                    self.idle_workers += 1
+                self.queue.task_done()
+
+    def _report(self):
+        while True:
+            time.sleep(self.stats_interval)
+            stats = self.stats()
+            self.log.log(
+                LogLevel.INFO, f"Worker pool: {stats['busy_workers']}/{stats['workers']} busy, queue {stats['queue_depth']}/{stats['queue_size']}, accepted {stats['accepted']}, rejected {stats['rejected']}, avg wait {stats['avg_wait_time'] * 1000:.1f}ms, max wait {stats['max_wait_time'] * 1000:.1f}ms")